@@ -1,5 +1,53 @@
+import hashlib
+import json
 import streamlit as st
 import requests
+import numpy as np
+import pandas as pd
+
+FHIR_BASE_URL = "https://ips-challenge.it.hs-heilbronn.de/fhir/"
+
+GLUCOSE_TITLE = "Results - Glucose Level" # LOINC 14749-6
+HBA1C_TITLE = "Results - Ac1-Test"        # LOINC 4548-4
+
+# Reference values according to ADA/EASD
+LOW_GLUCOSE = 70   # mg/dL - normal lower limit
+MID_GLUCOSE = 100  # mg/dL - prediabetes onset
+HIGH_GLUCOSE = 126 # mg/dL - diabetes diagnosis
+NORMAL_HEMO = 5.7  # % - normal upper limit
+MID_HEMO = 6.5     # % - diabetes diagnosis
+HIGH_HEMO = 8.0    # % - poor control
+
+# Bin edges and labels for pd.cut(..., right=False)
+GLUCOSE_BINS = [float("-inf"), LOW_GLUCOSE, MID_GLUCOSE, HIGH_GLUCOSE, float("inf")]
+GLUCOSE_LABELS = [
+    f'Hypoglycemia (< {LOW_GLUCOSE} mg/dL)',
+    f'Normal ({LOW_GLUCOSE}-{MID_GLUCOSE-1} mg/dL)',
+    f'Prediabetes ({MID_GLUCOSE}-{HIGH_GLUCOSE-1} mg/dL)',
+    f'Diabetes (≥ {HIGH_GLUCOSE} mg/dL)'
+]
+HBA1C_BINS = [float("-inf"), NORMAL_HEMO, MID_HEMO, HIGH_HEMO, float("inf")]
+HBA1C_LABELS = [
+    f'Normal (< {NORMAL_HEMO}%)',
+    f'Prediabetes ({NORMAL_HEMO}-{MID_HEMO-0.1:.1f}%)',
+    f'Controlled Diabetes ({MID_HEMO}-{HIGH_HEMO-0.1:.1f}%)',
+    f'Uncontrolled Diabetes (≥ {HIGH_HEMO}%)'
+]
+
+def fetch_clinical_data(request):
+    """
+    Get the json of the clinical data without showing errors, e.g. in a background thread
+        :param request: reference to e.g. observation
+        :return: clinical data as json, empty list if the server does not return it
+        :raises requests.RequestException: if the request fails
+    """
+    if "/_history/" in request:
+        return _read_versioned_resource(request)
+    url = f"{FHIR_BASE_URL}{request}"
+    response = requests.get(url)
+    if response.status_code == 200:
+        return response.json()
+    return []
 
 def search_for_clinical_data(request):
     """
@@ -8,15 +56,118 @@ def search_for_clinical_data(request):
         :return: clinical data as json
     """
     try:
-        url = f"https://ips-challenge.it.hs-heilbronn.de/fhir/{request}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
+        return fetch_clinical_data(request)
+    except requests.RequestException as e:
+        st.error(f"Error fetching data: {e}")
         return []
+
+@st.cache_data(show_spinner=False, max_entries=5000)
+def _read_versioned_resource(reference):
+    """
+    Read a versioned resource (vread). A version never changes, so the result is cached without ttl.
+    Failed reads raise and are therefore not cached.
+    :param reference: versioned reference, e.g. Composition/UC4-Composition/_history/51
+    :return: resource as json
+    """
+    response = requests.get(f"{FHIR_BASE_URL}{reference}")
+    response.raise_for_status()
+    return response.json()
+
+def search_for_versioned_data(reference):
+    """
+    Get the json of a versioned resource from the permanent cache
+    :param reference: versioned reference, e.g. Observation/abc/_history/2
+    :return: resource as json, empty list if it can not be read
+    """
+    try:
+        return _read_versioned_resource(reference)
     except requests.RequestException as e:
         st.error(f"Error fetching data: {e}")
         return []
 
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_composition_history(composition_id):
+    """
+    List the versions of a composition, newest first
+    :param composition_id: id of the composition
+    :return: list of dicts with the keys "versionId" and "lastUpdated"
+    :raises requests.RequestException: if the history can not be read, so the failure is not cached
+    """
+    response = requests.get(f"{FHIR_BASE_URL}Composition/{composition_id}/_history?_count=1000")
+    response.raise_for_status()
+    history = response.json()
+    versions = []
+    for entry in (history or {}).get("entry", []):
+        meta = entry.get("resource", {}).get("meta", {})
+        if "versionId" in meta:
+            versions.append({"versionId": meta["versionId"], "lastUpdated": meta.get("lastUpdated", "N/A")})
+    versions.sort(key=lambda v: int(v["versionId"]) if v["versionId"].isdigit() else 0, reverse=True)
+    return versions
+
+def fetch_composition_version(composition_id, version_id):
+    """
+    Get a specific version of a composition
+    :param composition_id: id of the composition
+    :param version_id: versionId of the composition
+    :return: composition as json, empty list if it can not be read
+    """
+    return search_for_versioned_data(f"Composition/{composition_id}/_history/{version_id}")
+
+def section_references(composition):
+    """
+    Collect the entry references of every section of a composition
+    :param composition: composition resource
+    :return: dict section code -> (section title, list of references in document order)
+    """
+    references = {}
+    for section in composition.get("section", []):
+        code = section.get("code", {}).get("coding", [{}])[0].get("code", "N/A")
+        refs = [entry["reference"] for entry in section.get("entry", []) if "reference" in entry]
+        title, known = references.get(code, (section.get("title", code), []))
+        references[code] = (title, known + refs)
+    return references
+
+def diff_composition_sections(old_composition, new_composition):
+    """
+    Compare the section references of two versions of a composition
+    :param old_composition: older composition resource
+    :param new_composition: newer composition resource
+    :return: dict section code -> {"Title", "Added", "Removed"}, only sections with changes
+    """
+    old_refs = section_references(old_composition)
+    new_refs = section_references(new_composition)
+    diff = {}
+    for code in dict.fromkeys(list(new_refs) + list(old_refs)):
+        title = (new_refs.get(code) or old_refs.get(code))[0]
+        new_list = new_refs.get(code, (title, []))[1]
+        old_list = old_refs.get(code, (title, []))[1]
+        old_set, new_set = set(old_list), set(new_list)
+        added = [ref for ref in new_list if ref not in old_set]
+        removed = [ref for ref in old_list if ref not in new_set]
+        if added or removed:
+            diff[code] = {"Title": title, "Added": added, "Removed": removed}
+    return diff
+
+def parse_numeric_values(values):
+    """
+    Get the number of value strings like "126 mg/dL", vectorized
+    Values repeat a lot, so every distinct string is parsed only once
+    :param values: pandas Series with the value strings
+    :return: numpy array of floats, NaN if there is no number
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_numeric(pd.Series(uniques, dtype="object").astype(str).str.extract(r'(\d+\.?\d*)', expand=False), errors="coerce")
+    parsed = np.append(parsed.to_numpy(dtype="float64"), np.nan)
+    return parsed[codes]
+
+def data_version(timeline_data):
+    """
+    Content hash of timeline data, used as cache key of the DataFrames and figures built from it
+    :param timeline_data: list of timeline rows
+    :return: hex digest
+    """
+    return hashlib.sha1(json.dumps(timeline_data, sort_keys=True, default=str).encode()).hexdigest()
+
 def fetch_fhir_data(url):
     """
     Get the data from a specific URL
@@ -43,22 +194,29 @@ def extract_timeline_data_observation(timeline_data, clinical_data):
     observation_name = code.get("display", "Unknown Observation")
     loinc = code.get("code", "N/A")
 
-    symbol = ""
+    title = "Results"
     if loinc == "14749-6":
-        symbol = " - Glucose Level"
+        title = GLUCOSE_TITLE
     elif loinc == "4548-4":
-        symbol = " - Ac1-Test"
+        title = HBA1C_TITLE
 
     value = clinical_data.get("valueQuantity", {}).get("value", "N/A")
     unit = clinical_data.get("valueQuantity", {}).get("code", "")
     value = f"{value} {unit}" if value != "N/A" else "No value"
 
-    timeline_data.append({
-        "Title": f"Results{symbol}",
+    row = {
+        "Title": title,
         "Name": observation_name,
         "Date": date,
-        "Value": value
-    })
+        "Value": value,
+        "Code": loinc
+    }
+    # reference range of the result, used instead of the threshold table of the lab panel
+    reference_range = clinical_data.get("referenceRange", [{}])[0]
+    if "low" in reference_range or "high" in reference_range:
+        row["Reference Low"] = reference_range.get("low", {}).get("value")
+        row["Reference High"] = reference_range.get("high", {}).get("value")
+    timeline_data.append(row)
 
 def extract_timeline_data_encounter(timeline_data, clinical_data):
     """
@@ -81,11 +239,13 @@ def extract_timeline_data_encounter(timeline_data, clinical_data):
 
     concept = clinical_data.get("medicationCodeableConcept", {}).get("coding", [{}])[0]
     encounter_name = concept.get("display", "Unknown Medication")
+    medication_code = concept.get("code", "N/A")
 
     timeline_data.append({
         "Title": title,
         "Name": encounter_name,
-        "Date": date
+        "Date": date,
+        "Code": medication_code
     })
 
     if clinical_data.get("resourceType") == "MedicationDispense":
@@ -95,7 +255,8 @@ def extract_timeline_data_encounter(timeline_data, clinical_data):
         timeline_data.append({
             "Title": "Medication Dispenses",
             "Name": encounter_name,
-            "Date": date
+            "Date": date,
+            "Code": medication_code
         })
 
 def extract_timeline_data_condition(timeline_data, clinical_data):
@@ -111,7 +272,8 @@ def extract_timeline_data_condition(timeline_data, clinical_data):
     timeline_data.append({
         "Title": "Problems",
         "Name": condition_name,
-        "Date": date
+        "Date": date,
+        "Code": code.get("code", "N/A")
     })
 
 def extract_timeline_data_intolerance(timeline_data, clinical_data):
@@ -132,7 +294,8 @@ def extract_timeline_data_intolerance(timeline_data, clinical_data):
         "Name": intolerance_name,
         "Date": date,
         "Reaction": reaction,
-        "Criticality": criticality
+        "Criticality": criticality,
+        "Code": code.get("code", "N/A")
     })
 
 def extract_timeline_data_vital(timeline_data, clinical_data):
@@ -183,7 +346,8 @@ def extract_timeline_data_history(timeline_data, clinical_data):
     history_name = "Observation - Other"
 
     value = clinical_data.get("valueCodeableConcept", {}).get("coding", [{}])[0].get("display", "No value")
-    note = clinical_data.get("note", [{}])[0].get("text", "No Note")
+    # all notes of the observation, they are shown and searched together
+    note = "; ".join(n["text"] for n in clinical_data.get("note", []) if n.get("text")) or "No Note"
     method = clinical_data.get("method", {}).get("coding", [{}])[0].get("display", "No Method")
 
     timeline_data.append({
@@ -194,3 +358,55 @@ def extract_timeline_data_history(timeline_data, clinical_data):
         "Note": note,
         "Method": method
     })
+
+# IPS section code -> function to extract the timeline data of one entry of this section
+SECTION_EXTRACTORS = {
+    "10160-0": extract_timeline_data_encounter,   # Medication: MedicationStatement | MedicationRequest | MedicationAdministration | MedicationDispense
+    "11450-4": extract_timeline_data_condition,   # Problems: Condition
+    "30954-2": extract_timeline_data_observation, # Results: Observation | DiagnosticReport
+    "48765-2": extract_timeline_data_intolerance, # Allergies: Allergy Intollerance
+    "8716-3": extract_timeline_data_vital,        # Vital: Observation
+    "29762-2": extract_timeline_data_history,     # Social: Observation
+}
+
+def extract_timeline_data(timeline_data, section_code, clinical_data):
+    """
+    Extract the information of an entry with the extractor of its IPS section
+    :param timeline_data: json to save the specific data and later print the timelines
+    :param section_code: LOINC code of the composition section the entry belongs to
+    :param clinical_data: extended data of the patient
+    """
+    extractor = SECTION_EXTRACTORS.get(section_code)
+    if extractor and clinical_data:
+        extractor(timeline_data, clinical_data)
+
+def build_timeline_data(composition, fetch=search_for_clinical_data, section_codes=None, timeline_data=None, on_error=None):
+    """
+    Resolve the entries of the IPS sections of a composition and extract their timeline information
+    :param composition: composition resource
+    :param fetch: function to get the json of a reference, e.g. Observation/abc
+    :param section_codes: LOINC codes of the sections to resolve, None for all supported sections
+    :param timeline_data: list the rows are appended to, keeps the rows resolved before an error; a new list if None
+    :param on_error: function (reference, exception) called for an entry whose resource can not be extracted,
+                     e.g. a malformed resource; the entry is skipped and the other entries are resolved.
+                     If None the exception is raised
+    :return: timeline data
+    """
+    if timeline_data is None:
+        timeline_data = []
+    for section in composition.get("section", []):
+        section_code = section.get("code", {}).get("coding", [{}])[0].get("code")
+        if section_code not in SECTION_EXTRACTORS or (section_codes is not None and section_code not in section_codes):
+            continue
+        for entry in section.get("entry", []):
+            if "reference" in entry:
+                size = len(timeline_data)
+                try:
+                    extract_timeline_data(timeline_data, section_code, fetch(entry["reference"]))
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    # rows of the failed entry are dropped
+                    del timeline_data[size:]
+                    on_error(entry["reference"], e)
+    return timeline_data
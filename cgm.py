@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+
+import lab_data
+import units
+
+# LOINC code of glucose measured by a continuous glucose monitor
+CGM_LOINC = "77145-5"
+
+# One reading every 5 minutes
+READINGS_PER_DAY = 288
+
+# Glucose bands of the international consensus on time in range (mg/dL)
+VERY_LOW_GLUCOSE = 54
+LOW_GLUCOSE = 70
+HIGH_GLUCOSE = 180
+VERY_HIGH_GLUCOSE = 250
+
+METRIC_COLUMNS = ["Start", "End", "Readings", "Coverage", "Mean Glucose", "GMI", "CV",
+                  "Very Low", "Low", "In Range", "High", "Very High"]
+
+class CGMStore:
+    """
+    Dense glucose series of one patient: sorted int64 timestamps (ns since epoch) and float32 values in mg/dL.
+    Metrics of any window are read from prefix sums, so many windows cost one searchsorted each.
+    """
+
+    def __init__(self, times=None, values=None):
+        self.times = np.asarray(times if times is not None else [], dtype=np.int64)
+        self.values = np.asarray(values if values is not None else [], dtype=np.float32)
+        self._prefix = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def extend(self, times, values):
+        """
+        Add readings, e.g. one page of a search; a reading with the time of a stored one replaces it
+        :param times: int64 timestamps in ns since epoch
+        :param values: glucose values in mg/dL
+        """
+        times = np.concatenate([self.times, np.asarray(times, dtype=np.int64)])
+        values = np.concatenate([self.values, np.asarray(values, dtype=np.float32)])
+        order = np.argsort(times, kind="stable")
+        times, values = times[order], values[order]
+        # keep the last reading of every timestamp
+        keep = np.r_[times[1:] != times[:-1], True] if len(times) else np.zeros(0, dtype=bool)
+        self.times, self.values = times[keep], values[keep]
+        self._prefix = None
+
+    def date_range(self):
+        """First and last reading time, None without readings"""
+        if not len(self):
+            return None
+        return pd.Timestamp(self.times[0]), pd.Timestamp(self.times[-1])
+
+    def window(self, start=None, end=None):
+        """Slice of the readings with start <= time < end"""
+        first = 0 if start is None else np.searchsorted(self.times, pd.Timestamp(start).value, side="left")
+        last = len(self) if end is None else np.searchsorted(self.times, pd.Timestamp(end).value, side="left")
+        return self.times[first:last], self.values[first:last]
+
+    def _prefix_sums(self):
+        """Cumulative sums of the readings with a leading zero row, computed once per content"""
+        if self._prefix is None:
+            values = self.values.astype(np.float64)
+            columns = np.column_stack([
+                np.ones_like(values),
+                values,
+                values * values,
+                values < VERY_LOW_GLUCOSE,
+                (values >= VERY_LOW_GLUCOSE) & (values < LOW_GLUCOSE),
+                (values >= LOW_GLUCOSE) & (values <= HIGH_GLUCOSE),
+                (values > HIGH_GLUCOSE) & (values <= VERY_HIGH_GLUCOSE),
+                values > VERY_HIGH_GLUCOSE
+            ])
+            self._prefix = np.vstack([np.zeros((1, columns.shape[1])), np.cumsum(columns, axis=0)])
+        return self._prefix
+
+    def metrics(self, starts, ends):
+        """
+        Standard CGM metrics of windows start <= time < end
+        :param starts: window starts (anything pd.DatetimeIndex accepts)
+        :param ends: window ends, same length as starts
+        :return: DataFrame with METRIC_COLUMNS, one row per window; band columns are shares of the readings
+        """
+        starts, ends = pd.DatetimeIndex(starts), pd.DatetimeIndex(ends)
+        prefix = self._prefix_sums()
+        first = np.searchsorted(self.times, starts.asi8, side="left")
+        last = np.searchsorted(self.times, ends.asi8, side="left")
+        sums = prefix[last] - prefix[first]
+        count = sums[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = sums[:, 1] / count
+            variance = (sums[:, 2] - count * mean * mean) / (count - 1)
+            sd = np.sqrt(np.clip(variance, 0, None))
+            bands = sums[:, 3:] / count[:, None]
+            days = (ends.asi8 - starts.asi8) / 86400e9
+            coverage = np.clip(count / (days * READINGS_PER_DAY), 0, 1)
+        return pd.DataFrame({
+            "Start": starts,
+            "End": ends,
+            "Readings": count.astype(np.int64),
+            "Coverage": coverage,
+            "Mean Glucose": mean,
+            # Glucose Management Indicator (Bergenstal et al. 2018), in %
+            "GMI": 3.31 + 0.02392 * mean,
+            "CV": np.where(count > 1, 100 * sd / mean, np.nan),
+            "Very Low": bands[:, 0],
+            "Low": bands[:, 1],
+            "In Range": bands[:, 2],
+            "High": bands[:, 3],
+            "Very High": bands[:, 4]
+        }, columns=METRIC_COLUMNS)
+
+    def daily_metrics(self, start, end):
+        """Metrics of every calendar day (UTC) from start to end (inclusive)"""
+        days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="D")
+        return self.metrics(days, days + pd.Timedelta(days=1))
+
+def parse_readings(observations):
+    """
+    Get the timestamps and mg/dL values of CGM Observations
+    Readings without time or value and readings in a unit without conversion are skipped
+    :param observations: list of Observation resources
+    :return: (int64 timestamps in ns since epoch, float32 values)
+    """
+    dates, values, value_units = [], [], []
+    for observation in observations:
+        quantity = observation.get("valueQuantity", {})
+        dates.append(observation.get("effectiveDateTime") or observation.get("effectivePeriod", {}).get("start"))
+        values.append(quantity.get("value"))
+        value_units.append(quantity.get("code") or quantity.get("unit"))
+    times = pd.to_datetime(pd.Series(dates, dtype=object), errors="coerce", format="ISO8601", utc=True)
+    values, convertible = units.normalize_units(
+        np.full(len(values), CGM_LOINC, dtype=object),
+        pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64),
+        value_units
+    )
+    valid = times.notna().to_numpy() & convertible & ~np.isnan(values)
+    times = times.dt.tz_localize(None).to_numpy().astype(np.int64)
+    return times[valid], values[valid].astype(np.float32)
+
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_cgm_store(fhir_server_url, patient_id, days=90, page_size=1000):
+    """
+    Get the CGM readings of the last days of a patient, page by page
+    Every page is parsed into arrays right away, so the readings are never held as timeline rows
+    Args:
+        fhir_server_url (str): FHIR Server URL
+        patient_id (str): The patient's ID
+        days (int): number of days to load, counted back from now
+        page_size (int): readings per page
+    Returns:
+        CGMStore: the readings
+    Raises:
+        requests.RequestException: if a page can not be read, so the failure is not cached
+        ValueError: if a page is not JSON
+    """
+    since = (pd.Timestamp.now(tz="UTC") - pd.Timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    store = CGMStore()
+    chunks = []
+    url = f"{fhir_server_url}Observation"
+    params = {
+        "patient": patient_id,
+        "code": f"{lab_data.LOINC_SYSTEM}|{CGM_LOINC}",
+        "date": f"ge{since}",
+        "_count": page_size
+    }
+    with requests.Session() as session:
+        while url:
+            response = session.get(url, params=params, headers={"accept": "application/fhir+json"}, timeout=30)
+            response.raise_for_status()
+            bundle = response.json()
+            chunks.append(parse_readings([entry["resource"] for entry in bundle.get("entry", [])
+                                          if entry.get("resource", {}).get("resourceType") == "Observation"]))
+            # the next link already contains the search parameters
+            url = next((link["url"] for link in bundle.get("link", []) if link.get("relation") == "next"), None)
+            params = None
+    if chunks:
+        store.extend(np.concatenate([times for times, _ in chunks]), np.concatenate([values for _, values in chunks]))
+    return store
@@ -0,0 +1,217 @@
+import hashlib
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import requests
+
+import calculation_data
+import units
+
+TIMING_COLUMNS = ["Patient", "Status", "Events", "Seconds", "Requests", "Errors"]
+
+# Worker process state, set by _init_worker
+_connection_budget = None
+_session = None
+
+def _init_worker(connection_budget):
+    """
+    Initialize a worker process of the cohort pool
+    :param connection_budget: semaphore shared by all workers, limits the open connections to the FHIR server
+    """
+    global _connection_budget, _session
+    _connection_budget = connection_budget
+    _session = requests.Session()
+
+def _fetch(url, stats):
+    """
+    Get the json of a url while holding one slot of the shared connection budget
+    :param url: url of fhir data
+    :param stats: dict counting the requests of the current patient
+    :return: json or None
+    """
+    stats["Requests"] += 1
+    try:
+        with _connection_budget:
+            response = _session.get(url, timeout=30)
+        if response.status_code == 200:
+            return response.json()
+    except requests.RequestException:
+        pass
+    stats["Errors"] += 1
+    return None
+
+def _load_patient(patient_id, fhir_server_url):
+    """
+    Run the calculate_patient_data pipeline for one patient inside a worker process
+    :param patient_id: the patient's ID
+    :param fhir_server_url: FHIR Server URL
+    :return: (timeline data with the patient id in every row, timing row)
+    """
+    start = time.perf_counter()
+    stats = {"Requests": 0, "Errors": 0}
+    timeline_data = []
+    composition_data = _fetch(f"{fhir_server_url}Composition?patient={patient_id}", stats)
+    if composition_data and "entry" in composition_data:
+        composition = composition_data["entry"][0]["resource"]
+        timeline_data = calculation_data.build_timeline_data(
+            composition, lambda reference: _fetch(fhir_server_url + reference, stats) or []
+        )
+        status = "Loaded"
+    else:
+        status = "No composition"
+    for row in timeline_data:
+        row["Patient"] = patient_id
+    timing = {
+        "Patient": patient_id,
+        "Status": status,
+        "Events": len(timeline_data),
+        "Seconds": time.perf_counter() - start,
+        **stats
+    }
+    return timeline_data, timing
+
+def fetch_group_members(fhir_server_url, group_id):
+    """
+    Get the patient IDs of the members of a FHIR Group
+    :param fhir_server_url: FHIR Server URL
+    :param group_id: id of the Group resource
+    :return: list of patient IDs
+    """
+    group = calculation_data.fetch_fhir_data(f"{fhir_server_url}Group/{group_id}")
+    patient_ids = []
+    for member in (group or {}).get("member", []):
+        reference = member.get("entity", {}).get("reference", "")
+        if reference.startswith("Patient/"):
+            patient_ids.append(reference.split("/", 1)[1])
+    return patient_ids
+
+def load_cohort(patient_ids, fhir_server_url=calculation_data.FHIR_BASE_URL, max_workers=4, max_connections=8, progress=None):
+    """
+    Load the IPS timelines of many patients with a process pool
+    :param patient_ids: list of patient IDs
+    :param fhir_server_url: FHIR Server URL
+    :param max_workers: number of worker processes
+    :param max_connections: number of requests to the FHIR server that may run at the same time over all workers
+    :param progress: optional function called with (loaded patients, total patients)
+    :return: (combined timeline DataFrame with a Patient column, DataFrame with the load timing per patient)
+    """
+    patient_ids = list(dict.fromkeys(patient_ids))
+    rows, timings = [], []
+    # spawn instead of fork: the streamlit server process runs several threads
+    context = multiprocessing.get_context("spawn")
+    connection_budget = context.BoundedSemaphore(max_connections)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                             initializer=_init_worker, initargs=(connection_budget,)) as executor:
+        futures = [executor.submit(_load_patient, patient_id, fhir_server_url) for patient_id in patient_ids]
+        for done, future in enumerate(as_completed(futures), start=1):
+            timeline_data, timing = future.result()
+            rows.extend(timeline_data)
+            timings.append(timing)
+            if progress:
+                progress(done, len(futures))
+
+    cohort_df = pd.DataFrame(rows, columns=None if rows else ["Patient", "Title", "Name", "Date", "Value", "Code"])
+    cohort_df["Date"] = pd.to_datetime(cohort_df["Date"], errors="coerce", format="ISO8601", utc=True)
+    cohort_df["Patient"] = cohort_df["Patient"].astype("category")
+    cohort_df["Title"] = cohort_df["Title"].astype("category")
+    timings_df = pd.DataFrame(timings, columns=TIMING_COLUMNS).sort_values("Seconds", ascending=False, ignore_index=True)
+    return cohort_df, timings_df
+
+def cohort_version(cohort_df, fhir_server_url):
+    """
+    Content hash of a loaded cohort, keys the cached analytics shared by all sessions
+    :param cohort_df: combined timeline DataFrame of load_cohort
+    :param fhir_server_url: FHIR Server URL the cohort was loaded from
+    :return: hex digest
+    """
+    digest = hashlib.sha1(fhir_server_url.encode())
+    digest.update("|".join(map(str, cohort_df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(cohort_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+# Timeline title -> (analyte, bin edges, band labels)
+GLYCEMIC_ANALYTES = {
+    calculation_data.GLUCOSE_TITLE: ("Glucose", calculation_data.GLUCOSE_BINS, calculation_data.GLUCOSE_LABELS),
+    calculation_data.HBA1C_TITLE: ("HbA1c", calculation_data.HBA1C_BINS, calculation_data.HBA1C_LABELS),
+}
+
+def glycemic_observations(cohort_df):
+    """
+    Select the glucose (LOINC 14749-6) and HbA1c (LOINC 4548-4) results of a cohort with numeric values
+    Values are converted to the canonical unit of their code (mg/dL, %) the ADA/EASD bands are defined in,
+    results whose unit has no conversion are left out
+    :param cohort_df: combined timeline DataFrame of load_cohort
+    :return: DataFrame with the columns Patient, Analyte, Date and Value (float), sorted by date
+    """
+    titles = list(GLYCEMIC_ANALYTES)
+    observations = cohort_df.loc[cohort_df["Title"].isin(titles) & cohort_df["Date"].notna(), ["Patient", "Title", "Date", "Value", "Code"]]
+    numbers, value_units = units.split_value_units(observations["Value"])
+    values, convertible = units.normalize_units(observations["Code"].to_numpy(dtype=object), numbers, value_units)
+    analytes = observations["Title"].map({title: analyte for title, (analyte, _, _) in GLYCEMIC_ANALYTES.items()})
+    observations = pd.DataFrame({
+        "Patient": observations["Patient"],
+        "Analyte": analytes.astype("category"),
+        "Date": observations["Date"],
+        "Value": np.where(convertible, values, np.nan)
+    }, index=observations.index).dropna(subset=["Value"])
+    return observations.sort_values("Date", kind="stable", ignore_index=True)
+
+def glycemic_summary(observations):
+    """
+    Compute per patient and analyte the latest value, the trend and the ADA/EASD band, without per patient loops
+    :param observations: DataFrame of glycemic_observations, sorted by date
+    :return: DataFrame with the columns Patient, Analyte, Count, Latest, Latest Date, Slope per Year and Band
+    """
+    if observations.empty:
+        return pd.DataFrame(columns=["Patient", "Analyte", "Count", "Latest", "Latest Date", "Slope per Year", "Band"])
+
+    # least squares slope from group sums: (n*Sxy - Sx*Sy) / (n*Sxx - Sx^2), x in days since the first observation
+    x = (observations["Date"] - observations["Date"].min()).dt.total_seconds().to_numpy() / 86400.0
+    y = observations["Value"].to_numpy()
+    frame = pd.DataFrame({
+        "Patient": observations["Patient"],
+        "Analyte": observations["Analyte"],
+        "x": x, "y": y, "xx": x * x, "xy": x * y
+    })
+    groups = frame.groupby(["Patient", "Analyte"], observed=True, sort=False)
+    sums = groups[["x", "y", "xx", "xy"]].sum()
+    n = groups.size().to_numpy()
+    denominator = n * sums["xx"].to_numpy() - sums["x"].to_numpy() ** 2
+    numerator = n * sums["xy"].to_numpy() - sums["x"].to_numpy() * sums["y"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(np.abs(denominator) > 1e-9, numerator / denominator, np.nan) * 365.25
+
+    latest = observations.groupby(["Patient", "Analyte"], observed=True, sort=False).agg(
+        Latest=("Value", "last"), LatestDate=("Date", "last")
+    ).reindex(sums.index)
+
+    summary = pd.DataFrame({
+        "Count": n,
+        "Latest": latest["Latest"].to_numpy(),
+        "Latest Date": latest["LatestDate"].to_numpy(),
+        "Slope per Year": slope
+    }, index=sums.index).reset_index()
+
+    bands = pd.Series(pd.NA, index=summary.index, dtype="object")
+    for analyte, bins, labels in GLYCEMIC_ANALYTES.values():
+        mask = (summary["Analyte"] == analyte).to_numpy()
+        bands[mask] = pd.cut(summary.loc[mask, "Latest"], bins=bins, labels=labels, right=False).astype("object")
+    summary["Band"] = bands
+    return summary
+
+def band_shares(summary):
+    """
+    Share of patients in each ADA/EASD band, based on their latest value
+    :param summary: DataFrame of glycemic_summary
+    :return: DataFrame with the columns Analyte, Band, Patients and Share, bands in threshold order
+    """
+    rows = []
+    for analyte, _, labels in GLYCEMIC_ANALYTES.values():
+        counts = summary.loc[summary["Analyte"] == analyte, "Band"].value_counts().reindex(labels, fill_value=0)
+        total = counts.sum()
+        for band, patients in counts.items():
+            rows.append({"Analyte": analyte, "Band": band, "Patients": int(patients), "Share": patients / total if total else 0.0})
+    return pd.DataFrame(rows)
@@ -1,10 +1,9 @@
 import streamlit as st
 import requests
-import folium
-from streamlit_folium import folium_static
+import streamlit.components.v1 as components
 
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+import map_cache
+from geocoding import get_location_coordinates
 
 import qrcode
 from io import BytesIO
@@ -347,37 +346,9 @@ def display_patient_info(patient_data):
                 
                 if coordinates:
                     with map_col:
-                        # Create the map with improved styling
-                        m = folium.Map(
-                            location=coordinates,
-                            zoom_start=15,
-                            width='100%',
-                            height='100%'
-                        )
-                        
-                        # Add a marker with a popup containing the address
-                        folium.Marker(
-                            coordinates,
-                            popup=folium.Popup(address_str, max_width=300),
-                            tooltip="Patient's Location",
-                            icon=folium.Icon(
-                                color='red',
-                                icon='info-sign',
-                                prefix='fa'
-                            )
-                        ).add_to(m)
-                        
-                        # Add a circle around the location
-                        folium.Circle(
-                            coordinates,
-                            radius=100,
-                            color='red',
-                            fill=True,
-                            fillOpacity=0.2
-                        ).add_to(m)
-                        
-                        # Display the map with custom size
-                        folium_static(m, width=400, height=300)  # Adjusted size for column
+                        # The rendered map is reused from the map cache
+                        html, _ = map_cache.address_map_html(address_str, coordinates, 400, 300)
+                        components.html(html, width=400, height=310)
                 else:
                     with map_col:
                         st.info("Location could not be displayed on map")
@@ -762,37 +733,6 @@ def display_patient_info(patient_data):
                 else:
                     st.error(f"Error registering {event_type}")
 
-def get_location_coordinates(address_str):
-    """
-    Get coordinates for an address using Nominatim geocoder.
-    
-    Args:
-        address_str (str): Address string to geocode
-    
-    Returns:
-        tuple: (latitude, longitude) or None if geocoding fails
-    """
-    try:
-        import ssl
-        import certifi
-        
-        ctx = ssl.create_default_context(cafile=certifi.where())
-        geolocator = Nominatim(
-            user_agent="patient_search_portal",
-            ssl_context=ctx
-        )
-        
-        location = geolocator.geocode(address_str, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        return None
-    except (GeocoderTimedOut, GeocoderUnavailable) as e:
-        st.warning(f"Geocoding error: {e}")
-        return None
-    except Exception as e:
-        st.warning(f"Error getting coordinates: {e}")
-        return None
-
 def generate_patient_qr(patient_id):
     """
     Generate QR code for a patient ID
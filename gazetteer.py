@@ -0,0 +1,173 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from geocoding import normalize_address
+
+# Columns of the GeoNames dump format (tab separated, no header)
+GEONAMES_COLUMNS = [
+    "geonameid", "name", "asciiname", "alternatenames", "latitude", "longitude", "feature class",
+    "feature code", "country code", "cc2", "admin1 code", "admin2 code", "admin3 code", "admin4 code",
+    "population", "elevation", "dem", "timezone", "modification date"
+]
+
+class KDTree:
+    """
+    Static k-d tree for nearest neighbour queries, built with np.argpartition
+    Leaves hold up to leaf_size points and are searched with one vectorized distance computation
+    """
+
+    def __init__(self, points, leaf_size=16):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.order = np.arange(len(self.points))
+        self.leaf_size = leaf_size
+        # node -> (start, end, split dimension, split value, left node, right node); leaves have dimension -1
+        self.nodes = []
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        """Build the subtree of the points order[start:end], return its node number"""
+        node = len(self.nodes)
+        self.nodes.append(None)
+        if end - start <= self.leaf_size:
+            self.nodes[node] = (start, end, -1, 0.0, -1, -1)
+            return node
+        points = self.points[self.order[start:end]]
+        dim = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        middle = (end - start) // 2
+        partition = np.argpartition(points[:, dim], middle)
+        self.order[start:end] = self.order[start:end][partition]
+        split = self.points[self.order[start + middle], dim]
+        left = self._build(start, start + middle)
+        right = self._build(start + middle, end)
+        self.nodes[node] = (start, end, dim, split, left, right)
+        return node
+
+    def nearest(self, point):
+        """
+        Nearest point of the tree
+        :param point: query point
+        :return: (index of the nearest point in the points given to the constructor, squared distance),
+                 (-1, inf) for an empty tree
+        """
+        point = np.asarray(point, dtype=np.float64)
+        best, best_distance = -1, np.inf
+        stack = [0] if self.nodes else []
+        while stack:
+            start, end, dim, split, left, right = self.nodes[stack.pop()]
+            if dim < 0:
+                candidates = self.order[start:end]
+                distances = ((self.points[candidates] - point) ** 2).sum(axis=1)
+                position = int(np.argmin(distances))
+                if distances[position] < best_distance:
+                    best, best_distance = int(candidates[position]), float(distances[position])
+                continue
+            near, far = (left, right) if point[dim] < split else (right, left)
+            # the far side is visited only if the split plane is closer than the best point so far
+            if (point[dim] - split) ** 2 < best_distance:
+                stack.append(far)
+            stack.append(near)
+        return best, best_distance
+
+def _unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere, the euclidean nearest point is also the nearest on the earth"""
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def _normalized(names):
+    """normalize_address of a whole column of names"""
+    return names.str.lower().str.replace(r"\s+", " ", regex=True).str.replace(r"\s*,\s*", ",", regex=True).str.strip()
+
+def _read_geonames(path):
+    """Places of a GeoNames extract: (normalized keys per place, names, latitudes, longitudes, population)"""
+    places = pd.read_csv(path, sep="\t", header=None, names=GEONAMES_COLUMNS, quoting=3, dtype=str,
+                         usecols=["name", "asciiname", "latitude", "longitude", "country code", "population"],
+                         keep_default_na=False)
+    name, asciiname, country = _normalized(places["name"]), _normalized(places["asciiname"]), _normalized(places["country code"])
+    names = [name, asciiname, name + "," + country, asciiname + "," + country]
+    return names, places["name"], places["latitude"], places["longitude"], pd.to_numeric(places["population"], errors="coerce")
+
+def _read_openaddresses(path):
+    """Addresses of an OpenAddresses CSV: (normalized keys per address, addresses, latitudes, longitudes, no population)"""
+    addresses = pd.read_csv(path, dtype=str, keep_default_na=False)
+    street = (addresses["NUMBER"] + " " + addresses["STREET"]).str.strip()
+    normalized_street, city = _normalized(street), _normalized(addresses["CITY"])
+    names = [normalized_street + "," + city + "," + _normalized(addresses["REGION"]),
+             normalized_street + "," + city,
+             normalized_street + "," + _normalized(addresses["POSTCODE"])]
+    label = street + ", " + addresses["CITY"]
+    return names, label, addresses["LAT"], addresses["LON"], pd.Series(np.nan, index=addresses.index)
+
+class Gazetteer:
+    """
+    Offline geocoder over a local gazetteer file: a GeoNames extract (.txt/.tsv) or an OpenAddresses CSV (.csv)
+    Forward lookups are dictionary lookups of normalized names, reverse lookups use a k-d tree
+    """
+
+    def __init__(self, path):
+        reader = _read_openaddresses if path.lower().endswith(".csv") else _read_geonames
+        names, labels, latitudes, longitudes, population = reader(path)
+        self.labels = labels.to_numpy(dtype=object)
+        self.latitudes = pd.to_numeric(latitudes, errors="coerce").to_numpy(dtype=np.float64)
+        self.longitudes = pd.to_numeric(longitudes, errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~np.isnan(self.latitudes) & ~np.isnan(self.longitudes)
+
+        # the most populated place wins a name shared by several places
+        ranking = np.argsort(-population.fillna(0).to_numpy(), kind="stable")
+        ranking = ranking[valid[ranking]]
+        self.index = {}
+        # later entries overwrite earlier ones: the first key column and the most populated place win
+        for keys in reversed(names):
+            self.index.update(zip(keys.to_numpy()[ranking[::-1]], ranking[::-1].tolist()))
+        self.tree = KDTree(_unit_vectors(self.latitudes[valid], self.longitudes[valid]))
+        self.tree_rows = np.flatnonzero(valid)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @staticmethod
+    def candidates(address_str):
+        """
+        Keys to try for an address, the most specific first: the whole address, without the trailing parts
+        (country, region, ...), without the leading parts (street, city, ...) and every part with the last one
+        A single part of a longer address is never tried on its own: a short name like "il" or a country
+        would place an unmatched street address at an unrelated place
+        """
+        parts = [part for part in normalize_address(address_str).split(",") if part]
+        if len(parts) < 2:
+            return parts
+        keys = [",".join(parts[:j]) for j in range(len(parts), 1, -1)]
+        keys += [",".join(parts[i:]) for i in range(1, len(parts) - 1)]
+        keys += [f"{part},{parts[-1]}" for part in parts[:-1]]
+        return list(dict.fromkeys(keys))
+
+    def lookup(self, address_str):
+        """
+        Coordinates of an address
+        :param address_str: address to geocode
+        :return: (latitude, longitude) or None if no key of the address is in the gazetteer
+        """
+        for key in self.candidates(address_str):
+            row = self.index.get(key)
+            if row is not None:
+                return float(self.latitudes[row]), float(self.longitudes[row])
+        return None
+
+    def reverse(self, latitude, longitude):
+        """
+        Nearest gazetteer entry of a point
+        :return: (name, latitude, longitude) or None for an empty gazetteer
+        """
+        position, _ = self.tree.nearest(_unit_vectors([latitude], [longitude])[0])
+        if position < 0:
+            return None
+        row = self.tree_rows[position]
+        return self.labels[row], float(self.latitudes[row]), float(self.longitudes[row])
+
+def load_gazetteer(path):
+    """The gazetteer of a file, None if the file does not exist"""
+    if not path or not os.path.exists(path):
+        return None
+    return Gazetteer(path)
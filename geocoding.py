@@ -0,0 +1,225 @@
+import json
+import os
+import re
+import ssl
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+import streamlit as st
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+from geopy.geocoders import Nominatim
+
+# File of the address -> coordinates cache, kept between server restarts
+GEOCODING_CACHE_PATH = os.environ.get(
+    "GEOCODING_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "conectaton2024", "geocoding.json")
+)
+
+# Addresses Nominatim did not find are asked again after this many seconds
+NEGATIVE_CACHE_SECONDS = 7 * 24 * 3600
+
+# Nominatim usage policy: at most one request per second
+NOMINATIM_REQUESTS_PER_SECOND = 1.0
+
+USER_AGENT = "patient_search_portal"
+
+# Geocoder configuration:
+#   GEOCODER_BACKEND: "online" (Nominatim) or "offline" (local gazetteer file, Nominatim only on a miss)
+#   GAZETTEER_PATH: GeoNames extract (.txt) or OpenAddresses CSV (.csv) of the offline backend
+#   GEOCODER_ONLINE_FALLBACK: "0" never asks Nominatim when the offline backend is used
+GEOCODER_BACKEND = os.environ.get("GEOCODER_BACKEND", "online")
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", "")
+GEOCODER_ONLINE_FALLBACK = os.environ.get("GEOCODER_ONLINE_FALLBACK", "1") != "0"
+
+class TokenBucket:
+    """
+    Thread safe token bucket: acquire blocks until a token is available
+    Tokens are refilled at rate per second up to capacity
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, waiting for the refill if the bucket is empty"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            # the token refilled while waiting is spent right away
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+def normalize_address(address_str):
+    """Cache key of an address: lower case, single spaces, no blanks around commas"""
+    return re.sub(r"\s*,\s*", ",", re.sub(r"\s+", " ", address_str.strip().lower()))
+
+class GeocodingService:
+    """
+    Geocoder with one shared Nominatim client, a persistent cache and a rate limit.
+    Found addresses are cached for good, addresses without result for NEGATIVE_CACHE_SECONDS.
+    Timeouts and unavailable service are not cached.
+    """
+
+    def __init__(self, cache_path=GEOCODING_CACHE_PATH, requests_per_second=NOMINATIM_REQUESTS_PER_SECOND, timeout=10):
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self._bucket = TokenBucket(requests_per_second)
+        self._geolocator = Nominatim(
+            user_agent=USER_AGENT,
+            ssl_context=ssl.create_default_context(cafile=certifi.where())
+        )
+        self._lock = threading.Lock()
+        self._cache = self._load()
+
+    def _load(self):
+        """Read the cache file, an unreadable file starts an empty cache"""
+        try:
+            with open(self.cache_path, encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """Write the cache file atomically, so a crash never leaves a half written file"""
+        directory = os.path.dirname(self.cache_path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False, suffix=".tmp") as tmp_file:
+                json.dump(self._cache, tmp_file)
+            os.replace(tmp_file.name, self.cache_path)
+        except OSError:
+            # the cache still works in memory
+            pass
+
+    def cached(self, address_str):
+        """
+        Look up an address in the cache only
+        :param address_str: address to geocode
+        :return: (True, (latitude, longitude) or None) on a cache hit, (False, None) otherwise
+        """
+        entry = self._cache.get(normalize_address(address_str))
+        if entry is None:
+            return False, None
+        if entry["coordinates"] is None and time.time() - entry["time"] > NEGATIVE_CACHE_SECONDS:
+            return False, None
+        return True, tuple(entry["coordinates"]) if entry["coordinates"] else None
+
+    def store(self, address_str, coordinates):
+        """Add a result to the cache and persist it"""
+        with self._lock:
+            self._cache[normalize_address(address_str)] = {
+                "coordinates": list(coordinates) if coordinates else None,
+                "time": time.time()
+            }
+            self._save()
+
+    def geocode(self, address_str):
+        """
+        Get the coordinates of an address, from the cache if possible
+        :param address_str: address to geocode
+        :return: (latitude, longitude) or None if the address is not found
+        :raises GeocoderServiceError: if Nominatim can not be reached or times out
+        """
+        hit, coordinates = self.cached(address_str)
+        if hit:
+            return coordinates
+        self._bucket.acquire()
+        location = self._geolocator.geocode(address_str, timeout=self.timeout)
+        coordinates = (location.latitude, location.longitude) if location else None
+        self.store(address_str, coordinates)
+        return coordinates
+
+@st.cache_resource(show_spinner=False)
+def get_geocoding_service():
+    """The geocoding service shared by all sessions"""
+    return GeocodingService()
+
+@st.cache_resource(show_spinner=False)
+def get_gazetteer(path=GAZETTEER_PATH):
+    """The offline gazetteer shared by all sessions, None if its file does not exist"""
+    import gazetteer
+    return gazetteer.load_gazetteer(path)
+
+def cached_location(address_str):
+    """
+    Get the coordinates of an address without network access: offline gazetteer and geocoding cache
+    :param address_str: address to geocode
+    :return: (True, (latitude, longitude) or None) if the answer is known, (False, None) if Nominatim must be asked
+    """
+    if GEOCODER_BACKEND == "offline":
+        local_gazetteer = get_gazetteer()
+        coordinates = local_gazetteer.lookup(address_str) if local_gazetteer is not None else None
+        if coordinates or not GEOCODER_ONLINE_FALLBACK:
+            return True, coordinates
+    return get_geocoding_service().cached(address_str)
+
+def locate(address_str):
+    """
+    Get the coordinates of an address with the configured backend
+    :param address_str: address to geocode
+    :return: (latitude, longitude) or None if the address is not found
+    :raises GeocoderServiceError: if Nominatim can not be reached or times out
+    """
+    hit, coordinates = cached_location(address_str)
+    if hit:
+        return coordinates
+    return get_geocoding_service().geocode(address_str)
+
+@st.cache_resource(show_spinner=False)
+def _geocoding_executor():
+    """One background thread for all sessions, Nominatim is asked one address at a time anyway"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocoding")
+
+# normalized address -> Future of the running lookup
+_running_lookups = {}
+_running_lookups_lock = threading.Lock()
+
+def locate_in_background(address_str):
+    """
+    Start geocoding an address in the background, a lookup of the same address already running is reused
+    :param address_str: address to geocode
+    :return: Future with the result of locate
+    """
+    key = normalize_address(address_str)
+    with _running_lookups_lock:
+        future = _running_lookups.get(key)
+        if future is None or future.done():
+            future = _geocoding_executor().submit(locate, address_str)
+            _running_lookups[key] = future
+            future.add_done_callback(lambda done: _forget_lookup(key, done))
+        return future
+
+def _forget_lookup(key, future):
+    """Remove a finished lookup, unless a newer lookup of the address replaced it"""
+    with _running_lookups_lock:
+        if _running_lookups.get(key) is future:
+            del _running_lookups[key]
+
+def get_location_coordinates(address_str):
+    """
+    Get coordinates for an address using the configured backend and the shared geocoding service.
+
+    Args:
+        address_str (str): Address string to geocode
+
+    Returns:
+        tuple: (latitude, longitude) or None if geocoding fails
+    """
+    try:
+        return locate(address_str)
+    except (GeocoderTimedOut, GeocoderUnavailable) as e:
+        st.warning(f"Geocoding error: {e}")
+        return None
+    except Exception as e:
+        st.warning(f"Error getting coordinates: {e}")
+        return None
@@ -0,0 +1,127 @@
+import streamlit as st
+import requests
+import numpy as np
+import pandas as pd
+
+import calculation_data
+
+LOINC_SYSTEM = "http://loinc.org"
+
+# FHIR Server URL -> whether the server answers Observation/$lastn
+_lastn_support = {}
+
+def _search_observations(url, params):
+    """
+    Run an Observation query without reporting errors on the page
+    :param url: query url
+    :param params: query parameters
+    :return: list of Observation resources, None if the server does not answer the query (client error status)
+    :raises requests.RequestException: if the server can not be reached or fails, so the failure is not cached
+    """
+    response = requests.get(url, params=params, headers={"accept": "application/fhir+json"}, timeout=30)
+    if response.status_code >= 500:
+        response.raise_for_status()
+    if response.status_code != 200:
+        return None
+    bundle = response.json()
+    return [entry["resource"] for entry in bundle.get("entry", [])
+            if entry.get("resource", {}).get("resourceType") == "Observation"]
+
+def _fetch_lastn(fhir_server_url, patient_id, max_per_code):
+    """One Observation/$lastn request for the latest results of every code of the laboratory category"""
+    if _lastn_support.get(fhir_server_url) is False:
+        return None
+    observations = _search_observations(f"{fhir_server_url}Observation/$lastn", {
+        "patient": patient_id,
+        "category": "laboratory",
+        "max": max_per_code
+    })
+    # only real answers of the server get here, connection problems raise
+    _lastn_support[fhir_server_url] = observations is not None
+    return observations
+
+def _fetch_sorted_search(fhir_server_url, patient_id, codes, max_per_code):
+    """
+    One Observation search for all codes, newest first
+    The search returns up to max_per_code results per code in total, the results of a code beyond
+    max_per_code are dropped, so a frequent code can leave fewer old results of the others
+    """
+    result = _search_observations(f"{fhir_server_url}Observation", {
+        "patient": patient_id,
+        "code": ",".join(f"{LOINC_SYSTEM}|{code}" for code in codes),
+        "_sort": "-date",
+        "_count": max_per_code * len(codes)
+    })
+    if result is None:
+        return None
+    observations, counts = [], {}
+    for observation in result:
+        code = next((coding.get("code") for coding in observation.get("code", {}).get("coding", [])
+                     if coding.get("system") == LOINC_SYSTEM and coding.get("code") in codes), None)
+        counts[code] = counts.get(code, 0) + 1
+        if counts[code] <= max_per_code:
+            observations.append(observation)
+    return observations
+
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_lab_series(fhir_server_url, patient_id, codes, max_per_code=100):
+    """
+    Get only the recent lab results plotted by the laboratory page, directly from the server
+    Uses Observation/$lastn for the latest results of every laboratory code, and falls back to
+    one sorted search of the given codes when the server does not support it
+    Args:
+        fhir_server_url (str): FHIR Server URL
+        patient_id (str): The patient's ID
+        codes (tuple): LOINC codes of the series searched without $lastn
+        max_per_code (int): maximum number of results per code
+    Returns:
+        list: timeline data of the results sorted by date, None if the server answers neither query
+    Raises:
+        requests.RequestException: if the server can not be reached or fails, so the failure is not cached
+    """
+    observations = _fetch_lastn(fhir_server_url, patient_id, max_per_code)
+    if observations is None:
+        observations = _fetch_sorted_search(fhir_server_url, patient_id, codes, max_per_code)
+    if observations is None:
+        return None
+
+    timeline_data = []
+    for observation in observations:
+        calculation_data.extract_timeline_data_observation(timeline_data, observation)
+    timeline_data.sort(key=lambda row: row["Date"])
+    return timeline_data
+
+# Trailing windows in days of the rolling statistics of the lab charts
+ROLLING_WINDOWS = (7, 30, 90)
+ROLLING_STATISTICS = ("Mean", "Median")
+
+def rolling_statistics(dates, values, windows=ROLLING_WINDOWS, statistics=ROLLING_STATISTICS):
+    """
+    Trailing rolling statistics of a lab series over calendar day windows
+    Args:
+        dates: datetimes of the results
+        values: numeric values of the results, results without date or value are skipped
+        windows (tuple): window lengths in days
+        statistics (tuple): "Mean" and/or "Median"
+    Returns:
+        DataFrame: Date sorted ascending and one column per window and statistic, e.g. "30-day Mean"
+    """
+    series = pd.Series(np.asarray(values, dtype=float), index=pd.DatetimeIndex(dates))
+    series = series[series.notna().to_numpy() & series.index.notna()].sort_index(kind="stable")
+    result = {"Date": series.index}
+    for days in windows:
+        # the window of a result holds the results of the days before it, itself included
+        rolling = series.rolling(f"{days}D", min_periods=1)
+        if "Mean" in statistics:
+            result[f"{days}-day Mean"] = rolling.mean().to_numpy()
+        if "Median" in statistics:
+            result[f"{days}-day Median"] = rolling.median().to_numpy()
+    return pd.DataFrame(result)
+
+def estimated_hba1c(mean_glucose):
+    """
+    Estimated HbA1c from the mean glucose, regression of the ADAG study: eHbA1c = (mean glucose + 46.7) / 28.7
+    :param mean_glucose: mean glucose in mg/dL (number or array)
+    :return: eHbA1c in %
+    """
+    return (np.asarray(mean_glucose, dtype=float) + 46.7) / 28.7
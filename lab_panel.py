@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+import calculation_data
+import units
+from timeline_index import parse_dates
+
+# LOINC code -> chart settings and threshold bands (pd.cut(..., right=False) edges and labels)
+# The bands are used when an Observation has no referenceRange; analytes missing here are still
+# plotted, with the status of their referenceRange only
+ANALYTES = {
+    "14749-6": {
+        "Name": "Glucose", "Chart": "Glucose Levels Over Time", "Axis": "Fasting Glucose",
+        "Bins": calculation_data.GLUCOSE_BINS, "Labels": calculation_data.GLUCOSE_LABELS
+    },
+    "4548-4": {
+        "Name": "HbA1c", "Chart": "Glycated Hemoglobin (HbA1c) Over Time", "Axis": "HbA1c",
+        "Bins": calculation_data.HBA1C_BINS, "Labels": calculation_data.HBA1C_LABELS
+    },
+    "2160-0": {
+        "Name": "Creatinine", "Chart": "Creatinine Over Time", "Axis": "Creatinine",
+        "Bins": [float("-inf"), 0.6, 1.3, float("inf")],
+        "Labels": ["Low (< 0.6 mg/dL)", "Normal (0.6-1.2 mg/dL)", "High (≥ 1.3 mg/dL)"]
+    },
+    "2093-3": {
+        "Name": "Total Cholesterol", "Chart": "Total Cholesterol Over Time", "Axis": "Total Cholesterol",
+        "Bins": [float("-inf"), 200, 240, float("inf")],
+        "Labels": ["Desirable (< 200 mg/dL)", "Borderline High (200-239 mg/dL)", "High (≥ 240 mg/dL)"]
+    },
+    "2085-9": {
+        "Name": "HDL Cholesterol", "Chart": "HDL Cholesterol Over Time", "Axis": "HDL Cholesterol",
+        "Bins": [float("-inf"), 40, 60, float("inf")],
+        "Labels": ["Low (< 40 mg/dL)", "Normal (40-59 mg/dL)", "Protective (≥ 60 mg/dL)"]
+    },
+    "13457-7": {
+        "Name": "LDL Cholesterol", "Chart": "LDL Cholesterol Over Time", "Axis": "LDL Cholesterol",
+        "Bins": [float("-inf"), 100, 130, 160, 190, float("inf")],
+        "Labels": ["Optimal (< 100 mg/dL)", "Near Optimal (100-129 mg/dL)", "Borderline High (130-159 mg/dL)",
+                   "High (160-189 mg/dL)", "Very High (≥ 190 mg/dL)"]
+    },
+    "2571-8": {
+        "Name": "Triglycerides", "Chart": "Triglycerides Over Time", "Axis": "Triglycerides",
+        "Bins": [float("-inf"), 150, 200, 500, float("inf")],
+        "Labels": ["Normal (< 150 mg/dL)", "Borderline High (150-199 mg/dL)", "High (200-499 mg/dL)", "Very High (≥ 500 mg/dL)"]
+    },
+    "62238-1": {
+        "Name": "eGFR", "Chart": "Estimated Glomerular Filtration Rate Over Time", "Axis": "eGFR",
+        "Bins": [float("-inf"), 15, 30, 45, 60, 90, float("inf")],
+        "Labels": ["G5 Kidney Failure (< 15)", "G4 Severely Decreased (15-29)", "G3b Moderately to Severely Decreased (30-44)",
+                   "G3a Mildly to Moderately Decreased (45-59)", "G2 Mildly Decreased (60-89)", "G1 Normal (≥ 90)"]
+    },
+}
+
+PANEL_COLUMNS = ["Code", "Name", "Date", "Value", "Unit", "Reported", "Low", "High", "Band", "Status"]
+
+class LabPanel:
+    """
+    Numeric lab results of one patient indexed by LOINC code.
+    Every code is a contiguous date sorted slice of one frame, so reading a series does not scan the others.
+    """
+
+    def __init__(self, frame):
+        """
+        :param frame: DataFrame with PANEL_COLUMNS
+        """
+        self.frame = frame.sort_values(["Code", "Date"], kind="stable", ignore_index=True)
+        # LOINC code -> slice of its rows
+        codes = self.frame["Code"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.zeros(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(codes)]
+        self.partitions = {codes[start]: slice(start, end) for start, end in zip(starts, ends)}
+
+    @classmethod
+    def from_timeline_data(cls, timeline_data):
+        """
+        Index the Observation rows with a LOINC code and a numeric value
+        Values are converted to the canonical unit of their code, rows whose unit has no conversion are left out
+        Args:
+            timeline_data (list): timeline rows
+        Returns:
+            tuple: (LabPanel, DataFrame of the rows left out for their unit with Code, Name, Date and Reported)
+        """
+        df = pd.DataFrame(timeline_data)
+        if not {"Code", "Date", "Value"} <= set(df.columns):
+            return cls(pd.DataFrame(columns=PANEL_COLUMNS)), pd.DataFrame(columns=["Code", "Name", "Date", "Reported"])
+        df = df[df["Code"].notna() & (df["Code"] != "N/A")]
+        numbers, value_units = units.split_value_units(df["Value"])
+        codes = df["Code"].to_numpy(dtype=object)
+        low = pd.to_numeric(df["Reference Low"], errors="coerce").to_numpy(dtype=float) if "Reference Low" in df.columns else np.full(len(df), np.nan)
+        high = pd.to_numeric(df["Reference High"], errors="coerce").to_numpy(dtype=float) if "Reference High" in df.columns else np.full(len(df), np.nan)
+
+        # codes with a canonical unit are converted, the others keep the reported values
+        canonical = np.isin(codes, list(units.CANONICAL_UNITS))
+        converted, convertible = units.normalize_units(codes, numbers, value_units)
+        values = np.where(canonical, converted, numbers)
+        low = np.where(canonical, units.normalize_units(codes, low, value_units)[0], low)
+        high = np.where(canonical, units.normalize_units(codes, high, value_units)[0], high)
+        convertible |= ~canonical
+        frame = pd.DataFrame({
+            "Code": codes,
+            "Name": df["Name"].to_numpy() if "Name" in df.columns else None,
+            "Date": parse_dates(df["Date"]).to_numpy(),
+            "Value": values,
+            "Unit": np.where(canonical, pd.Series(codes).map(units.CANONICAL_UNITS).to_numpy(dtype=object), value_units),
+            "Reported": df["Value"].to_numpy(),
+            "Low": low,
+            "High": high
+        })
+        frame = frame[frame["Date"].notna().to_numpy() & ~np.isnan(numbers)]
+        left_out = frame[~convertible[frame.index]]
+        frame = frame[convertible[frame.index]].reset_index(drop=True)
+        frame["Band"], frame["Status"] = cls._status(frame)
+        return cls(frame[PANEL_COLUMNS]), left_out[["Code", "Name", "Date", "Reported"]]
+
+    @staticmethod
+    def _status(frame):
+        """
+        Band of the threshold table and status of every row
+        The status is the position in the referenceRange if the Observation has one, the band otherwise
+        """
+        codes = frame["Code"].to_numpy(dtype=object)
+        values = frame["Value"].to_numpy()
+        low, high = frame["Low"].to_numpy(), frame["High"].to_numpy()
+        band = np.full(len(frame), None, dtype=object)
+        for code in np.intersect1d(pd.unique(codes).astype(str), list(ANALYTES)):
+            mask = codes == code
+            band[mask] = pd.cut(values[mask], bins=ANALYTES[code]["Bins"], labels=ANALYTES[code]["Labels"], right=False).astype(object)
+        has_range = ~np.isnan(low) | ~np.isnan(high)
+        with np.errstate(invalid="ignore"):
+            in_range = np.select([values < low, values > high], ["Below Reference Range", "Above Reference Range"], "Within Reference Range")
+        return band, np.where(has_range, in_range, band)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def analytes(self):
+        """
+        Analytes of the patient, the configured ones first
+        :return: DataFrame with Code, Name, Unit, Results and Latest Date per code
+        """
+        rows = []
+        for code, rows_slice in self.partitions.items():
+            series = self.frame.iloc[rows_slice]
+            rows.append({
+                "Code": code,
+                "Name": ANALYTES.get(code, {}).get("Name") or series["Name"].iloc[-1] or code,
+                "Unit": series["Unit"].iloc[-1],
+                "Results": len(series),
+                "Latest Date": series["Date"].iloc[-1]
+            })
+        analytes = pd.DataFrame(rows, columns=["Code", "Name", "Unit", "Results", "Latest Date"])
+        configured = analytes["Code"].map({code: position for position, code in enumerate(ANALYTES)}).fillna(len(ANALYTES))
+        return analytes.iloc[np.argsort(configured.to_numpy(), kind="stable")].reset_index(drop=True)
+
+    def series(self, code):
+        """
+        Results of one analyte sorted by date
+        :param code: LOINC code
+        :return: DataFrame with PANEL_COLUMNS, empty if the patient has no result of the code
+        """
+        return self.frame.iloc[self.partitions.get(code, slice(0, 0))]
+
+    def date_range(self):
+        """(first date, last date) of all results"""
+        return self.frame["Date"].min(), self.frame["Date"].max()
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+import folium
+import streamlit as st
+
+# Rendered maps kept by the shared cache
+MAP_CACHE_ENTRIES = 256
+
+class MapHTMLCache:
+    """
+    LRU cache of rendered map HTML keyed by (latitude, longitude, address, width, height)
+    The render time of every entry is kept, so each hit adds the time it saved to the statistics
+    """
+
+    def __init__(self, max_entries=MAP_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (html, seconds the render took)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.render_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, render):
+        """
+        HTML of a key, rendered on a miss
+        :param key: hashable cache key
+        :param render: function without arguments returning the HTML
+        :return: (html, True on a cache hit)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return entry[0], True
+        # render outside the lock, two sessions rendering the same map at once is harmless
+        start = time.perf_counter()
+        html = render()
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.misses += 1
+            self.render_seconds += seconds
+            self._entries[key] = (html, seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return html, False
+
+    def stats(self):
+        """Counters of the cache as a dict"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "Entries": len(self._entries),
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Evictions": self.evictions,
+                "Hit Rate": self.hits / lookups if lookups else 0.0,
+                "Render Seconds": self.render_seconds,
+                "Saved Seconds": self.saved_seconds
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_map_cache():
+    """The map cache shared by all sessions"""
+    return MapHTMLCache()
+
+def render_address_map(address_str, coordinates):
+    """
+    HTML of a map centered on an address, with a marker and a circle around the location
+    :param address_str: address shown in the marker popup
+    :param coordinates: (latitude, longitude)
+    :return: html page of the map
+    """
+    m = folium.Map(
+        location=coordinates,
+        zoom_start=15,
+        width='100%',
+        height='100%'
+    )
+
+    # Add a marker with a popup containing the address
+    folium.Marker(
+        coordinates,
+        popup=folium.Popup(address_str, max_width=300),
+        tooltip="Patient's Location",
+        icon=folium.Icon(
+            color='red',
+            icon='info-sign',
+            prefix='fa'
+        )
+    ).add_to(m)
+
+    # Add a circle around the location
+    folium.Circle(
+        coordinates,
+        radius=100,
+        color='red',
+        fill=True,
+        fillOpacity=0.2
+    ).add_to(m)
+
+    # same page folium_static renders for a map
+    return folium.Figure().add_child(m).render()
+
+def address_map_html(address_str, coordinates, width, height):
+    """
+    Rendered map of an address from the shared cache
+    :return: (html, True if the map came from the cache)
+    """
+    key = (round(coordinates[0], 7), round(coordinates[1], 7), address_str, width, height)
+    return get_map_cache().get(key, lambda: render_address_map(address_str, coordinates))
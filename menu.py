@@ -8,6 +8,10 @@ reports_results = st.Page("views/reports_results.py", title="Reports & Results")
 new_event = st.Page("views/new_event.py", title="New Event")
 timeline = st.Page("views/timeline.py", title="Clinical timeline")
 laboratory = st.Page("views/laboratory.py", title="Laboratory results")
+cgm = st.Page("views/cgm.py", title="Continuous glucose monitoring")
+history = st.Page("views/history.py", title="Composition history")
+cohort = st.Page("views/cohort.py", title="Cohort")
+cohort_glycemic = st.Page("views/cohort_glycemic.py", title="Cohort glycemic analytics")
 
 def update_navigation():
     """Update navigation based on patient selection"""
@@ -15,16 +19,12 @@ def update_navigation():
     if "patient_id" in st.session_state and st.session_state.patient_id:
         # Si hay un paciente, mostrar todas las páginas
         pages = [fhir_web, demographics, clinical, encounters_procedures, 
-                reports_results, new_event, timeline, laboratory]
-        
-        # Verificar si los datos del laboratorio están disponibles
-        if "laboratory_data" not in st.session_state:
-            st.session_state.laboratory_data = []
-            
+                reports_results, new_event, timeline, laboratory, cgm, history, cohort, cohort_glycemic]
+
         return st.navigation(pages)
     
-    # Si no hay paciente, solo mostrar la página de búsqueda
-    return st.navigation([fhir_web])
+    # Si no hay paciente, solo mostrar la página de búsqueda y la cohorte
+    return st.navigation([fhir_web, cohort, cohort_glycemic])
 
 # Set this True if you want to use the history data of Martas composition instead if the current version
 st.session_state.history = True
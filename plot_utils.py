@@ -0,0 +1,58 @@
+import numpy as np
+import plotly.graph_objects as go
+
+# Above this number of points a trace is drawn with WebGL instead of SVG
+WEBGL_THRESHOLD = 1000
+# Maximum number of points of one series sent to the browser
+MAX_POINTS_PER_SERIES = 2000
+
+def scatter_trace_type(n_points):
+    """
+    Plotly trace type for a number of points: SVG for small series, WebGL for large ones
+    :param n_points: number of points of the figure
+    :return: go.Scatter or go.Scattergl
+    """
+    return go.Scattergl if n_points > WEBGL_THRESHOLD else go.Scatter
+
+def render_mode(n_points):
+    """render_mode argument of plotly express for a number of points"""
+    return "webgl" if n_points > WEBGL_THRESHOLD else "svg"
+
+def _buckets(x, n_buckets):
+    """Equal width bucket of every sorted x value (datetime64 or numbers)"""
+    x = np.asarray(x).astype("int64").astype("float64")
+    span = x[-1] - x[0]
+    if span == 0:
+        return np.zeros(len(x), dtype=np.int64)
+    return np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+
+def _first_per_bucket(bucket, positions):
+    """First of the given positions in every bucket"""
+    _, first = np.unique(bucket[positions], return_index=True)
+    return positions[first]
+
+def minmax_downsample(x, y, max_points=MAX_POINTS_PER_SERIES):
+    """
+    Keep the minimum and the maximum of every x bucket, so peaks and dips of a series stay visible
+    :param x: sorted x values (datetime64 or numbers)
+    :param y: y values, NaN values are dropped
+    :param max_points: maximum number of points to keep
+    :return: sorted positions of the points to keep
+    """
+    y = np.asarray(y, dtype="float64")
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= max_points:
+        return valid
+    values = y[valid]
+    bucket = _buckets(np.asarray(x)[valid], max(1, (max_points - 2) // 2))
+    # x is sorted, so every bucket is a contiguous segment
+    starts = np.flatnonzero(np.r_[True, np.diff(bucket) != 0])
+    counts = np.diff(np.r_[starts, len(bucket)])
+    mins = np.repeat(np.minimum.reduceat(values, starts), counts)
+    maxs = np.repeat(np.maximum.reduceat(values, starts), counts)
+    keep = np.concatenate([
+        _first_per_bucket(bucket, np.flatnonzero(values == mins)),
+        _first_per_bucket(bucket, np.flatnonzero(values == maxs)),
+        [0, len(valid) - 1]
+    ])
+    return valid[np.unique(keep)]
@@ -0,0 +1,170 @@
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+# "ResourceType/id" at the end of a relative or absolute reference, an optional version is dropped
+_REFERENCE = re.compile(r"(?:^|/)([A-Z][A-Za-z]+)/([A-Za-z0-9\-.]{1,64})(?:/_history/[^/]+)?$")
+
+def reference_key(reference, full_urls=None):
+    """
+    Key "ResourceType/id" of a reference
+    :param reference: relative, absolute or versioned reference, or the fullUrl of a Bundle entry
+    :param full_urls: dict fullUrl -> key of the Bundle the reference comes from, resolves urn:uuid references
+    :return: key, None for contained (#id) and unresolvable references
+    """
+    if full_urls and reference in full_urls:
+        return full_urls[reference]
+    return _parse_reference(reference)
+
+@lru_cache(maxsize=65536)
+def _parse_reference(reference):
+    """Key of a reference string, references like Patient/x repeat in every resource so they are parsed once"""
+    match = _REFERENCE.search(reference)
+    if not match:
+        return None
+    return f"{match.group(1)}/{match.group(2)}"
+
+def resource_key(resource):
+    """Key "ResourceType/id" of a resource, None without id"""
+    if not resource.get("id") or not resource.get("resourceType"):
+        return None
+    return f"{resource['resourceType']}/{resource['id']}"
+
+def _references(element, path, found):
+    """Collect (path, reference) of every Reference in a dict, path is its dotted field path"""
+    reference = element.get("reference")
+    if type(reference) is str:
+        found.append((path, reference))
+    for field, value in element.items():
+        # only dicts and lists can hold references, primitive values are skipped without a call
+        kind = type(value)
+        if kind is dict:
+            _references(value, f"{path}.{field}" if path else field, found)
+        elif kind is list:
+            for item in value:
+                if type(item) is dict:
+                    # references of contained resources are indexed as references of their container
+                    _references(item, f"{path}.{field}" if path else field, found)
+    return found
+
+class ResourceGraph:
+    """
+    Resources of one patient indexed by "ResourceType/id"
+    Every reference is indexed both ways when its resource is added: forward (resource -> what it references)
+    and reverse (resource -> what references it), so relationships are dictionary lookups.
+    """
+
+    def __init__(self):
+        # key -> resource
+        self.resources = {}
+        # key -> list of (field path, target key)
+        self.forward = {}
+        # target key -> list of (field path, source key)
+        self.reverse = defaultdict(list)
+        # keys a fetch did not find, they are not asked for again
+        self.not_found = set()
+        # graphs are shared between sessions, resources fetched later are added under the lock
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __contains__(self, reference):
+        return reference_key(reference) in self.resources
+
+    def add(self, resource, full_urls=None):
+        """
+        Add a resource and index its references, a resource added again replaces the former one
+        :param resource: FHIR resource
+        :param full_urls: dict fullUrl -> key of the Bundle of the resource
+        :return: key of the resource, None if it has no id
+        """
+        key = resource_key(resource)
+        if key is None:
+            return None
+        targets = []
+        for path, reference in _references(resource, "", []):
+            target = reference_key(reference, full_urls)
+            if target is not None and target != key:
+                targets.append((path, target))
+        with self._lock:
+            if key in self.forward:
+                self._unlink(key)
+            self.resources[key] = resource
+            self.forward[key] = targets
+            for path, target in targets:
+                self.reverse[target].append((path, key))
+        return key
+
+    def _unlink(self, key):
+        """Remove the reverse entries of the references of a resource"""
+        for path, target in self.forward.pop(key):
+            self.reverse[target] = [(p, source) for p, source in self.reverse[target] if source != key]
+
+    def add_bundle(self, bundle):
+        """
+        Add all resources of a Bundle, or of a list of its entries, in one pass
+        :return: keys of the added resources
+        """
+        entries = bundle.get("entry", []) if isinstance(bundle, dict) else bundle
+        full_urls = {}
+        for entry in entries:
+            key = resource_key(entry.get("resource", {}))
+            if key and entry.get("fullUrl"):
+                full_urls[entry["fullUrl"]] = key
+        return [key for entry in entries if (key := self.add(entry.get("resource", {}), full_urls))]
+
+    def get(self, reference):
+        """Resource of a reference or key, None if it is not in the graph"""
+        key = reference_key(reference)
+        return self.resources.get(key) if key else None
+
+    def mark_not_found(self, keys):
+        """Remember keys a fetch did not find, keys added to the graph meanwhile are left out"""
+        with self._lock:
+            self.not_found.update(key for key in keys if key not in self.resources)
+
+    def missing(self, references):
+        """Keys of references whose resource is not in the graph and was not fetched in vain, without duplicates"""
+        keys = (reference_key(reference) for reference in references)
+        return [key for key in dict.fromkeys(keys) if key and key not in self.resources and key not in self.not_found]
+
+    def references(self, reference, path=None):
+        """
+        Keys referenced by a resource
+        :param reference: resource key or reference
+        :param path: only references in this field path, e.g. "result" or "section.entry"
+        :return: list of keys in document order
+        """
+        targets = self.forward.get(reference_key(reference) or "", [])
+        return [target for p, target in targets if path is None or p == path]
+
+    def referenced_by(self, reference, resource_type=None, path=None):
+        """
+        Keys of the resources referencing a resource
+        :param reference: resource key or reference
+        :param resource_type: only sources of this type, e.g. "DiagnosticReport"
+        :param path: only references in this field path of the sources, e.g. "encounter"
+        :return: list of keys without duplicates
+        """
+        sources = self.reverse.get(reference_key(reference) or "", [])
+        return list(dict.fromkeys(
+            source for p, source in sources
+            if (path is None or p == path) and (resource_type is None or source.startswith(resource_type + "/"))
+        ))
+
+    def related(self, reference, path=None):
+        """Resources referenced by a resource that are in the graph, e.g. the Observations of a report's result"""
+        return [self.resources[key] for key in self.references(reference, path) if key in self.resources]
+
+def build_graph(bundles):
+    """
+    Graph of the resources of several Bundles (or lists of Bundle entries)
+    :param bundles: iterable of Bundles
+    :return: ResourceGraph
+    """
+    graph = ResourceGraph()
+    for bundle in bundles:
+        graph.add_bundle(bundle)
+    return graph
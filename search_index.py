@@ -0,0 +1,119 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from itertools import chain
+
+import numpy as np
+
+# Words, numbers and codes like 14749-6 or 2.5; accents are removed before
+_TOKEN = re.compile(r"[0-9a-z]+(?:[-.][0-9a-z]+)*")
+
+# Row fields that are not searched
+SKIPPED_FIELDS = {"Date", "Exact Date", "Reference Low", "Reference High", "Color", "Symbol"}
+
+# Placeholders of the timeline extractors for missing values
+PLACEHOLDERS = {"N/A", "No value", "No Value", "No Note", "No Method", "No reaction", "Unknown"}
+
+def _searchable_text(value):
+    """Text of a row value to tokenize, numbers as they are written (5.5, 120), None for values not searched"""
+    if isinstance(value, str):
+        return None if value in PLACEHOLDERS else value
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)) and value == value:
+        return str(int(value)) if float(value).is_integer() else str(float(value))
+    return None
+
+def tokenize(text):
+    """Lower case tokens of a text without accents, e.g. "Retinopatía diabética" -> ["retinopatia", "diabetica"]"""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return _TOKEN.findall("".join(char for char in text if not unicodedata.combining(char)))
+
+class SearchIndex:
+    """
+    Inverted full-text index of timeline rows, filled incrementally as the sections of a patient load
+    Every query token matches the indexed tokens it is a prefix of; the rows must match all query tokens.
+    """
+
+    def __init__(self):
+        # document id -> timeline row
+        self.documents = []
+        # token -> sorted list of document ids
+        self.postings = {}
+        # (sorted tokens, offsets, flat postings, number of documents) for the prefix lookups
+        self._flat = self._flatten()
+        # sections are added from the background threads of the section loader
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, rows):
+        """
+        Index timeline rows, e.g. the rows of one section once it is loaded
+        Names, values, codes, notes and the other text fields are tokenized; dates are not
+        :param rows: list of timeline row dicts
+        """
+        with self._lock:
+            for row in rows:
+                document = len(self.documents)
+                self.documents.append(row)
+                tokens = set()
+                for field, value in row.items():
+                    text = None if field in SKIPPED_FIELDS else _searchable_text(value)
+                    if text is not None:
+                        tokens.update(tokenize(text))
+                for token in tokens:
+                    postings = self.postings.get(token)
+                    if postings is None:
+                        self.postings[token] = [document]
+                    else:
+                        postings.append(document)
+            # rebuilt here, by the thread loading the section, so queries never wait for it
+            self._flat = self._flatten()
+
+    def _flatten(self):
+        """
+        Postings of all tokens in one array, in the order of the sorted tokens
+        The documents of the tokens with a prefix are then one contiguous slice: documents[offsets[start]:offsets[end]]
+        :return: (sorted tokens, offsets, documents, number of documents)
+        """
+        vocabulary = sorted(self.postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(self.postings[token]) for token in vocabulary), dtype=np.int64, count=len(vocabulary)), out=offsets[1:])
+        documents = np.fromiter(chain.from_iterable(self.postings[token] for token in vocabulary), dtype=np.int64, count=int(offsets[-1]))
+        return vocabulary, offsets, documents, len(self.documents)
+
+    def search(self, query):
+        """
+        Rows matching every token of a query by prefix, e.g. "metf" finds "Metformin 500 MG"
+        :param query: search text
+        :return: sorted array of document ids
+        """
+        no_match = np.zeros(0, dtype=np.int64)
+        terms = tokenize(query)
+        if not terms:
+            return no_match
+        vocabulary, offsets, documents, count = self._flat
+        slices = []
+        for term in set(terms):
+            start = bisect_left(vocabulary, term)
+            end = bisect_left(vocabulary, term + "\uffff", start)
+            if start == end:
+                return no_match
+            slices.append(documents[offsets[start]:offsets[end]])
+        # the narrowest term gives the candidates, the other terms only filter them
+        slices.sort(key=len)
+        matches = np.zeros(count, dtype=bool)
+        matches[slices[0]] = True
+        result = np.flatnonzero(matches)
+        for postings in slices[1:]:
+            matches = np.zeros(count, dtype=bool)
+            matches[postings] = True
+            result = result[matches[result]]
+            if not len(result):
+                return no_match
+        return result
+
+    def rows(self, documents):
+        """Timeline rows of document ids"""
+        return [self.documents[document] for document in documents]
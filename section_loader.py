@@ -0,0 +1,212 @@
+import hashlib
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+import streamlit as st
+
+import calculation_data
+from search_index import SearchIndex
+
+# All IPS sections with timeline data, e.g. for the clinical timeline
+ALL_SECTIONS = tuple(calculation_data.SECTION_EXTRACTORS)
+
+class SectionLoader:
+    """
+    Resolves the entries of the IPS sections of a composition lazily.
+    Every section is resolved once, on first access or in the background, and memoized.
+    The rows of every resolved section are added to a full-text search index of the patient record.
+    Sections are resolved without Streamlit calls, fetch errors are kept with the section and shown by the script.
+    """
+
+    def __init__(self, composition, max_workers=2):
+        """
+        :param composition: composition resource
+        :param max_workers: threads resolving sections in the background
+        """
+        self.composition = composition
+        self.section_codes = [
+            code for code in dict.fromkeys(
+                section.get("code", {}).get("coding", [{}])[0].get("code") for section in composition.get("section", [])
+            ) if code in calculation_data.SECTION_EXTRACTORS
+        ]
+        self._futures = {}
+        # sections whose fetch errors were shown already
+        self._reported = set()
+        self.search_index = SearchIndex()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="section_loader")
+        # a loader dropped with its session stops its threads as well
+        weakref.finalize(self, self._executor.shutdown, wait=False, cancel_futures=True)
+
+    def _resolve(self, section_code):
+        """
+        (timeline data, content hash, error messages) of one section
+        Errors are kept with the section instead of raised, so every page consuming it still gets its rows
+        """
+        errors = []
+
+        def fetch(reference):
+            try:
+                return calculation_data.fetch_clinical_data(reference)
+            except requests.RequestException as e:
+                errors.append(f"Error fetching data: {e}")
+                return []
+
+        def skip(reference, error):
+            # e.g. an extractor failing on a malformed resource, the other entries are still resolved
+            errors.append(f"Error reading {reference}: {error}")
+
+        timeline_data = []
+        try:
+            calculation_data.build_timeline_data(self.composition, fetch=fetch, section_codes={section_code},
+                                                 timeline_data=timeline_data, on_error=skip)
+        except Exception as e:
+            # a malformed section: it keeps the rows resolved so far
+            errors.append(f"Error loading section {section_code}: {e}")
+        self.search_index.add(timeline_data)
+        return timeline_data, calculation_data.data_version(timeline_data), errors
+
+    def _requested(self, section_codes):
+        if section_codes is None:
+            return list(self.section_codes)
+        return [code for code in self.section_codes if code in section_codes]
+
+    def get(self, section_codes=None):
+        """
+        Get the timeline data of some sections, resolving the ones that are not loaded yet
+        :param section_codes: LOINC codes of the sections, None for all sections
+        :return: timeline data in the order of the composition sections
+        """
+        codes = self._requested(section_codes)
+        for code in codes:
+            with self._lock:
+                future = self._futures.get(code)
+                # a section still waiting in the background queue is resolved right away instead
+                resolve_here = future is None or future.cancel()
+                if resolve_here:
+                    future = Future()
+                    self._futures[code] = future
+            if resolve_here:
+                try:
+                    future.set_result(self._resolve(code))
+                except Exception as e:
+                    future.set_exception(e)
+        return [row for code in codes for row in self._futures[code].result()[0]]
+
+    def sections(self, section_codes=None):
+        """
+        Get the timeline data of some sections one by one, e.g. to process every section only once
+        :param section_codes: LOINC codes of the sections, None for all sections
+        :return: list of (content hash, timeline data) per section in the order of the composition sections
+        """
+        codes = self._requested(section_codes)
+        self.get(codes)
+        return [(self._futures[code].result()[1], self._futures[code].result()[0]) for code in codes]
+
+    def version(self, section_codes=None):
+        """
+        Content hash of the timeline data of some sections, computed once per section when it is resolved
+        :param section_codes: LOINC codes of the sections, None for all sections
+        :return: hex digest
+        """
+        codes = self._requested(section_codes)
+        self.get(codes)
+        return hashlib.sha1("".join(self._futures[code].result()[1] for code in codes).encode()).hexdigest()
+
+    def errors(self, section_codes=None):
+        """
+        Fetch errors of the resolved sections that were not returned before
+        :param section_codes: LOINC codes of the sections, None for all sections
+        :return: list of error messages
+        """
+        messages = []
+        with self._lock:
+            for code in self._requested(section_codes):
+                future = self._futures.get(code)
+                if code in self._reported or future is None or not future.done() or future.cancelled() or future.exception():
+                    continue
+                self._reported.add(code)
+                messages += future.result()[2]
+        return messages
+
+    def prefetch(self, section_codes=None):
+        """
+        Resolve sections in the background that were not requested yet
+        :param section_codes: LOINC codes of the sections, None for all sections
+        """
+        with self._lock:
+            for code in self._requested(section_codes):
+                if code not in self._futures:
+                    self._futures[code] = self._executor.submit(self._resolve, code)
+
+    def loaded_sections(self):
+        """LOINC codes of the sections that are resolved already"""
+        with self._lock:
+            return [code for code, future in self._futures.items() if future.done() and not future.cancelled()]
+
+    def close(self):
+        """Stop resolving sections in the background, e.g. when another patient is selected"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def start_loading(composition):
+    """
+    Replace the section loader of the session with one for the given composition and
+    start resolving its sections in the background
+    :param composition: composition resource
+    """
+    previous = st.session_state.get("section_loader")
+    if previous is not None:
+        previous.close()
+    loader = SectionLoader(composition)
+    loader.prefetch()
+    st.session_state.section_loader = loader
+
+def get_timeline_data(section_codes=None):
+    """
+    Get the timeline data of the sections a page consumes
+    :param section_codes: LOINC codes of the sections, None for all sections
+    :return: timeline data, empty list if no patient data is loaded
+    """
+    loader = st.session_state.get("section_loader")
+    if loader is None:
+        return []
+    timeline_data = loader.get(section_codes)
+    # errors of the background threads are shown here, in the script thread
+    for message in loader.errors(section_codes):
+        st.error(message)
+    loader.prefetch()
+    return timeline_data
+
+def get_data_version(section_codes=None):
+    """
+    Content hash of the timeline data of the sections a page consumes
+    :param section_codes: LOINC codes of the sections, None for all sections
+    :return: hex digest, None if no patient data is loaded
+    """
+    loader = st.session_state.get("section_loader")
+    if loader is None:
+        return None
+    return loader.version(section_codes)
+
+def get_search_index():
+    """
+    Full-text search index of the sections loaded so far
+    :return: SearchIndex, None if no patient data is loaded
+    """
+    loader = st.session_state.get("section_loader")
+    if loader is None:
+        return None
+    return loader.search_index
+
+def get_section_data(section_codes=None):
+    """
+    Get the timeline data of the sections a page consumes one by one
+    :param section_codes: LOINC codes of the sections, None for all sections
+    :return: list of (content hash, timeline data) per section
+    """
+    loader = st.session_state.get("section_loader")
+    if loader is None:
+        return []
+    return loader.sections(section_codes)
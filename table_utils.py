@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Rows sent to the browser per table page
+PAGE_SIZE = 50
+
+ORIGINAL_ORDER = "(original order)"
+
+# A number, optionally followed by a unit
+NUMBER_WITH_UNIT = r"^\s*(-?\d+(?:\.\d+)?)(?:\s+\D.*)?$"
+
+def sort_order(frame, column, descending=False):
+    """
+    Row positions of a frame sorted by one column, stable so equal values keep their order
+    Columns with mostly numbers (a unit may follow, as in "7.2 mmol/L") sort numerically, the others as text;
+    missing values and "N/A" go last
+    :param frame: DataFrame
+    :param column: column name
+    :param descending: sort from the largest value
+    :return: numpy array of row positions
+    """
+    values = frame[column]
+    numbers = pd.to_numeric(values.astype(str).str.extract(NUMBER_WITH_UNIT, expand=False), errors="coerce")
+    if numbers.notna().sum() * 2 >= values.notna().sum() and numbers.notna().any():
+        keys = numbers
+    else:
+        keys = values.astype(str).where(values.notna() & (values != "N/A"))
+    order = keys.reset_index(drop=True).sort_values(ascending=not descending, kind="stable", na_position="last")
+    return order.index.to_numpy()
+
+def page_bounds(rows, page, page_size=PAGE_SIZE):
+    """(first row, end row) of a 1-based page, the page is clipped to the existing pages"""
+    pages = max(1, math.ceil(rows / page_size))
+    page = min(max(1, page), pages)
+    return (page - 1) * page_size, min(page * page_size, rows)
+
+def paginated_table(rows, key, page_size=PAGE_SIZE):
+    """
+    Show rows with st.dataframe, one page at a time
+    Sorting and paging run on the server, only the rows of the visible page are sent to the browser.
+    Tables fitting on one page are shown whole and sorted in the browser.
+    :param rows: list of row dicts or DataFrame
+    :param key: unique widget key prefix of the table
+    :param page_size: rows per page
+    """
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    if len(frame) <= page_size:
+        st.dataframe(frame, hide_index=True, use_container_width=True)
+        return
+
+    sort_col, order_col, page_col = st.columns([2, 1, 1])
+    with sort_col:
+        sort_by = st.selectbox("Sort by", [ORIGINAL_ORDER] + list(frame.columns), key=f"{key}_sort")
+    with order_col:
+        descending = st.toggle("Descending", key=f"{key}_descending", disabled=sort_by == ORIGINAL_ORDER)
+    with page_col:
+        pages = math.ceil(len(frame) / page_size)
+        # the table may have shrunk since the page was chosen
+        if st.session_state.get(f"{key}_page", 1) > pages:
+            st.session_state[f"{key}_page"] = pages
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+    start, end = page_bounds(len(frame), page, page_size)
+    if sort_by == ORIGINAL_ORDER:
+        positions = np.arange(start, end)
+    else:
+        positions = sort_order(frame, sort_by, descending)[start:end]
+    st.dataframe(frame.iloc[positions], hide_index=True, use_container_width=True)
+    st.caption(f"Rows {start + 1}–{end} of {len(frame)}")
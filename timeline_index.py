@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+
+import units
+
+# Bucket sizes of the precomputed aggregates, from fine to coarse
+RESOLUTIONS = ("day", "week", "month")
+# Largest date span in days that is shown with each bucket size, so a chart has at most a few hundred points per Title
+RESOLUTION_MAX_DAYS = {"day": 400, "week": 400 * 7}
+
+def parse_dates(dates):
+    """
+    Parse timeline dates, with and without time or offset, as naive UTC datetimes
+    :param dates: Series with the date strings
+    :return: datetime64 Series, NaT if a date can not be parsed
+    """
+    return pd.to_datetime(dates, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+
+def bucket_starts(dates, resolution):
+    """
+    Start of the day, week (Monday) or month bucket of every date
+    :param dates: datetime64 numpy array
+    :param resolution: one of RESOLUTIONS
+    :return: datetime64[ns] numpy array
+    """
+    if resolution == "month":
+        return dates.astype('datetime64[M]').astype('datetime64[ns]')
+    days = dates.astype('datetime64[D]')
+    if resolution == "week":
+        # 1970-01-01 was a Thursday, day 4 of the epoch is the first Monday
+        days = ((days.astype(np.int64) - 4) // 7 * 7 + 4).astype('datetime64[D]')
+    return days.astype('datetime64[ns]')
+
+def pick_resolution(start, end):
+    """
+    Bucket size for a date span
+    :param start: first date
+    :param end: last date
+    :return: one of RESOLUTIONS
+    """
+    span_days = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    for resolution in RESOLUTIONS[:-1]:
+        if span_days <= RESOLUTION_MAX_DAYS[resolution]:
+            return resolution
+    return RESOLUTIONS[-1]
+
+class TimelineIndex:
+    """
+    Timeline rows sorted by date with a partition per Title.
+    A date range of a Title is a contiguous window of its partition, found by binary search,
+    so selecting rows costs O(log n) per Title plus the size of the result.
+    """
+
+    def __init__(self, df):
+        """
+        :param df: timeline DataFrame with a valid datetime64 Date in every row
+        """
+        self.frame = df.sort_values('Date', kind='stable', ignore_index=True)
+        self.dates = self.frame['Date'].to_numpy()
+        # Title -> (row positions sorted by date, their dates)
+        self.partitions = {
+            title: (positions, self.dates[positions])
+            for title, positions in self.frame.groupby('Title', sort=False).indices.items()
+        }
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def titles(self):
+        """Titles in order of their first event"""
+        return list(self.partitions)
+
+    def date_range(self):
+        """(first date, last date) of the timeline"""
+        return self.frame['Date'].iloc[0], self.frame['Date'].iloc[-1]
+
+    def select(self, start, end, titles=None):
+        """
+        Rows with start <= Date < end
+        :param start: first date (inclusive)
+        :param end: last date (exclusive)
+        :param titles: Titles to select, None for all
+        :return: DataFrame sorted by date
+        """
+        start, end = np.datetime64(pd.Timestamp(start)), np.datetime64(pd.Timestamp(end))
+        if titles is None or set(titles) >= set(self.partitions):
+            first, last = np.searchsorted(self.dates, [start, end], side='left')
+            return self.frame.iloc[first:last]
+        windows = [np.empty(0, dtype=np.int64)]
+        for title in titles:
+            if title in self.partitions:
+                positions, dates = self.partitions[title]
+                first, last = np.searchsorted(dates, [start, end], side='left')
+                windows.append(positions[first:last])
+        # positions index the date sorted frame, sorting them restores the date order
+        return self.frame.iloc[np.sort(np.concatenate(windows))]
+
+class TimelineAggregates:
+    """
+    Day, week and month aggregates per Title and code: number of events and min/mean/max of the numeric results.
+    Values are converted to the canonical unit of their LOINC code, a bucket whose numeric results still have
+    more than one unit keeps only its count.
+    Aggregates of new timeline data are merged in with add, without touching the rows aggregated before.
+    """
+
+    # aggregation of the bucket columns; the lowest and highest unit of the numeric results tell if a bucket mixes units
+    AGGREGATION = {'Count': 'sum', 'Numeric Count': 'sum', 'Sum': 'sum', 'Min': 'min', 'Max': 'max', 'Unit Low': 'min', 'Unit High': 'max'}
+    # Unit Low and Unit High of the rows without a numeric value, they never win the min and max
+    NO_UNIT_LOW, NO_UNIT_HIGH = "\uffff", ""
+
+    def __init__(self):
+        # resolution -> DataFrame indexed by (Title, Code, Bucket) with the columns of AGGREGATION
+        self.levels = {resolution: None for resolution in RESOLUTIONS}
+
+    @classmethod
+    def from_timeline_data(cls, timeline_data):
+        """
+        Aggregate timeline data
+        :param timeline_data: list of timeline rows
+        :return: TimelineAggregates
+        """
+        aggregates = cls()
+        df = pd.DataFrame(timeline_data, columns=None if timeline_data else ['Title', 'Date'])
+        dates = parse_dates(df['Date']) if 'Date' in df.columns else pd.Series(pd.NaT, index=df.index)
+        valid = dates.notna().to_numpy()
+        if not valid.any():
+            return aggregates
+        df = df[valid]
+        codes = df['Code'].fillna("").astype(str).to_numpy(dtype=object) if 'Code' in df.columns else np.full(len(df), "", dtype=object)
+        if 'Value' in df.columns:
+            numbers, value_units = units.split_value_units(df['Value'])
+        else:
+            numbers, value_units = np.full(len(df), np.nan), np.full(len(df), "", dtype=object)
+        # values of codes with a canonical unit are converted, the others keep their reported unit
+        converted, convertible = units.normalize_units(codes, numbers, value_units)
+        canonical = np.isin(codes, list(units.CANONICAL_UNITS)) & convertible
+        values = np.where(canonical, converted, numbers)
+        value_units = np.where(canonical, pd.Series(codes).map(units.CANONICAL_UNITS).to_numpy(dtype=object), value_units)
+        numeric = ~np.isnan(values)
+        titles = df['Title'].to_numpy()
+        for resolution in RESOLUTIONS:
+            frame = pd.DataFrame({
+                'Title': titles,
+                'Code': codes,
+                'Bucket': bucket_starts(dates.to_numpy()[valid], resolution),
+                'Count': 1,
+                'Numeric Count': numeric.astype(np.int64),
+                'Sum': np.where(numeric, values, 0.0),
+                'Min': values,
+                'Max': values,
+                'Unit Low': np.where(numeric, value_units, cls.NO_UNIT_LOW),
+                'Unit High': np.where(numeric, value_units, cls.NO_UNIT_HIGH)
+            })
+            aggregates.levels[resolution] = frame.groupby(['Title', 'Code', 'Bucket']).agg(cls.AGGREGATION)
+        return aggregates
+
+    def add(self, other):
+        """
+        Merge the aggregates of other timeline data into these aggregates
+        :param other: TimelineAggregates
+        """
+        for resolution in RESOLUTIONS:
+            mine, theirs = self.levels[resolution], other.levels[resolution]
+            if theirs is None:
+                continue
+            if mine is None:
+                self.levels[resolution] = theirs
+                continue
+            self.levels[resolution] = pd.concat([mine, theirs]).groupby(level=['Title', 'Code', 'Bucket']).agg(self.AGGREGATION)
+
+    def select(self, resolution, start, end, titles=None):
+        """
+        Buckets overlapping the range start <= Date < end
+        :param resolution: one of RESOLUTIONS
+        :param start: first date (inclusive)
+        :param end: last date (exclusive)
+        :param titles: Titles to select, None for all
+        :return: DataFrame with the columns Title, Code, Bucket, Count, Min, Mean, Max and Unit
+                 (Min, Mean and Max are NaN without numeric results or with results in several units)
+        """
+        columns = ['Title', 'Code', 'Bucket', 'Count', 'Min', 'Mean', 'Max', 'Unit']
+        level = self.levels[resolution]
+        if level is None:
+            return pd.DataFrame(columns=columns)
+        level = level.reset_index()
+        # the bucket containing start is included
+        first_bucket = bucket_starts(np.array([pd.Timestamp(start).to_datetime64()]), resolution)[0]
+        mask = (level['Bucket'] >= first_bucket) & (level['Bucket'] < pd.Timestamp(end))
+        if titles is not None:
+            mask &= level['Title'].isin(titles)
+        level = level[mask]
+        single_unit = ((level['Numeric Count'] > 0) & (level['Unit Low'] == level['Unit High'])).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(single_unit, level['Sum'] / level['Numeric Count'], np.nan)
+        return pd.DataFrame({
+            'Title': level['Title'],
+            'Code': level['Code'],
+            'Bucket': level['Bucket'],
+            'Count': level['Count'],
+            'Min': np.where(single_unit, level['Min'], np.nan),
+            'Mean': mean,
+            'Max': np.where(single_unit, level['Max'], np.nan),
+            'Unit': np.where(single_unit, level['Unit Low'], "")
+        }, columns=columns).sort_values('Bucket', kind='stable', ignore_index=True)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# Unit every lab series is plotted and compared in, per LOINC code
+CANONICAL_UNITS = {
+    "14749-6": "mg/dL",   # Glucose in serum or plasma
+    "77145-5": "mg/dL",   # Glucose by continuous monitor
+    "4548-4": "%",        # HbA1c
+    "2160-0": "mg/dL",    # Creatinine
+    "2093-3": "mg/dL",    # Total cholesterol
+    "2085-9": "mg/dL",    # HDL cholesterol
+    "13457-7": "mg/dL",   # LDL cholesterol (calculated)
+    "2571-8": "mg/dL",    # Triglycerides
+    "62238-1": "mL/min/{1.73_m2}",  # eGFR (CKD-EPI)
+}
+
+# (LOINC code, UCUM unit) -> (factor, offset): value in the canonical unit = value * factor + offset
+UNIT_CONVERSIONS = {
+    ("14749-6", "mg/dL"): (1.0, 0.0),
+    ("14749-6", "mmol/L"): (18.016, 0.0),
+    ("77145-5", "mg/dL"): (1.0, 0.0),
+    ("77145-5", "mmol/L"): (18.016, 0.0),
+    ("4548-4", "%"): (1.0, 0.0),
+    # IFCC to NGSP master equation
+    ("4548-4", "mmol/mol"): (0.09148, 2.152),
+    ("2160-0", "mg/dL"): (1.0, 0.0),
+    ("2160-0", "umol/L"): (1 / 88.42, 0.0),
+    ("2093-3", "mg/dL"): (1.0, 0.0),
+    ("2093-3", "mmol/L"): (38.67, 0.0),
+    ("2085-9", "mg/dL"): (1.0, 0.0),
+    ("2085-9", "mmol/L"): (38.67, 0.0),
+    ("13457-7", "mg/dL"): (1.0, 0.0),
+    ("13457-7", "mmol/L"): (38.67, 0.0),
+    ("2571-8", "mg/dL"): (1.0, 0.0),
+    ("2571-8", "mmol/L"): (88.57, 0.0),
+    ("62238-1", "mL/min/{1.73_m2}"): (1.0, 0.0),
+    ("62238-1", "mL/min/1.73m2"): (1.0, 0.0),
+}
+
+def _conversion_lookup():
+    """UNIT_CONVERSIONS with lower case units; a value without unit is taken to be in the canonical unit"""
+    lookup = {(code, unit.lower()): conversion for (code, unit), conversion in UNIT_CONVERSIONS.items()}
+    lookup.update({(code, ""): (1.0, 0.0) for code in CANONICAL_UNITS})
+    return lookup
+
+_CONVERSION_LOOKUP = _conversion_lookup()
+
+def split_value_units(values):
+    """
+    Split value strings like "7.2 mmol/L" into number and unit, vectorized
+    Values repeat a lot, so every distinct string is parsed only once
+    :param values: pandas Series with the value strings
+    :return: (numpy array of floats, NaN if there is no number; numpy array of unit strings, "" if there is none)
+    """
+    codes, uniques = pd.factorize(values)
+    parts = pd.Series(uniques, dtype="object").astype(str).str.extract(r'^\s*(-?\d+(?:\.\d+)?)\s*(.*?)\s*$')
+    numbers = np.append(pd.to_numeric(parts[0], errors="coerce").to_numpy(dtype="float64"), np.nan)
+    units = np.append(parts[1].fillna("").to_numpy(dtype=object), "")
+    return numbers[codes], units[codes]
+
+def normalize_units(codes, values, units):
+    """
+    Convert lab values to the canonical unit of their LOINC code with the UNIT_CONVERSIONS table
+    The conversion is looked up once per distinct (code, unit) pair and applied to whole arrays
+    :param codes: LOINC codes
+    :param values: numbers
+    :param units: UCUM units, "" or None for values in the canonical unit
+    :return: (numpy array of the converted values, NaN where there is no conversion;
+              bool array, False where the (code, unit) pair can not be converted)
+    """
+    code_ids, code_uniques = pd.factorize(np.asarray(codes, dtype=object))
+    # missing codes (-1) point to an appended empty code
+    code_uniques = np.append(code_uniques.astype(object), "")
+    code_ids = np.where(code_ids < 0, len(code_uniques) - 1, code_ids)
+    unit_ids, unit_uniques = pd.factorize(np.asarray(units, dtype=object))
+    # spelling variants of a unit like "mg/dl" and "mg/dL " become one unit
+    unit_ids, unit_uniques = pd.factorize(np.append(
+        pd.Series(unit_uniques, dtype="object").fillna("").astype(str).str.strip().str.lower().to_numpy(dtype=object), ""
+    )[unit_ids])
+    pair_ids, pair_uniques = pd.factorize(code_ids.astype(np.int64) * len(unit_uniques) + unit_ids)
+    conversions = np.array([
+        _CONVERSION_LOOKUP.get((code_uniques[pair // len(unit_uniques)], unit_uniques[pair % len(unit_uniques)]), (np.nan, np.nan))
+        for pair in pair_uniques
+    ], dtype="float64").reshape(-1, 2)
+    factors, offsets = conversions[pair_ids, 0], conversions[pair_ids, 1]
+    return np.asarray(values, dtype="float64") * factors + offsets, ~np.isnan(factors)
@@ -0,0 +1,101 @@
+import streamlit as st
+import requests
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import calculation_data
+import cgm
+import plot_utils
+
+st.title("Continuous Glucose Monitoring")
+
+st.markdown(f"""
+Metrics of the glucose readings of a continuous glucose monitor (LOINC {cgm.CGM_LOINC}),
+following the international consensus on time in range:
+
+- Time in range: {cgm.LOW_GLUCOSE}-{cgm.HIGH_GLUCOSE} mg/dL, target > 70% of the readings
+- Time below range: < {cgm.LOW_GLUCOSE} mg/dL, target < 4% (< {cgm.VERY_LOW_GLUCOSE} mg/dL: target < 1%)
+- Time above range: > {cgm.HIGH_GLUCOSE} mg/dL, target < 25% (> {cgm.VERY_HIGH_GLUCOSE} mg/dL: target < 5%)
+- Coefficient of variation: target ≤ 36%
+""")
+
+# Check if a patient is selected
+if "patient_id" not in st.session_state or not st.session_state.patient_id:
+    st.warning("Please select a patient first.")
+    st.stop()
+
+try:
+    store = cgm.fetch_cgm_store(
+        st.session_state.get('fhir_server_url') or calculation_data.FHIR_BASE_URL,
+        st.session_state.patient_id
+    )
+except (requests.RequestException, ValueError) as e:
+    st.error(f"The FHIR server did not answer the search for CGM readings: {e}")
+    st.stop()
+if not len(store):
+    st.warning("No CGM readings available for this patient in the last 90 days.")
+    st.stop()
+
+first_reading, last_reading = store.date_range()
+st.sidebar.header("Filter Options")
+days = st.sidebar.selectbox("Period", [14, 30, 90], format_func=lambda value: f"Last {value} days")
+end = last_reading.floor("D") + pd.Timedelta(days=1)
+start = end - pd.Timedelta(days=days)
+
+metrics = store.metrics([start], [end]).iloc[0]
+if metrics["Readings"] == 0:
+    st.warning("No CGM readings in the selected period.")
+    st.stop()
+
+readings_col, mean_col, gmi_col, cv_col = st.columns(4)
+readings_col.metric("Readings", f"{metrics['Readings']}", f"{metrics['Coverage']:.0%} of the period", delta_color="off")
+mean_col.metric("Mean glucose", f"{metrics['Mean Glucose']:.0f} mg/dL")
+gmi_col.metric("GMI", f"{metrics['GMI']:.1f} %")
+cv_col.metric("CV", f"{metrics['CV']:.1f} %")
+
+bands = pd.DataFrame({
+    "Band": [f"Very High (> {cgm.VERY_HIGH_GLUCOSE} mg/dL)", f"High ({cgm.HIGH_GLUCOSE + 1}-{cgm.VERY_HIGH_GLUCOSE} mg/dL)",
+             f"In Range ({cgm.LOW_GLUCOSE}-{cgm.HIGH_GLUCOSE} mg/dL)", f"Low ({cgm.VERY_LOW_GLUCOSE}-{cgm.LOW_GLUCOSE - 1} mg/dL)",
+             f"Very Low (< {cgm.VERY_LOW_GLUCOSE} mg/dL)"],
+    "Share": [metrics["Very High"], metrics["High"], metrics["In Range"], metrics["Low"], metrics["Very Low"]],
+    "Period": f"Last {days} days"
+})
+fig_bands = px.bar(
+    bands,
+    x="Period",
+    y="Share",
+    color="Band",
+    text=bands["Share"].map("{:.0%}".format),
+    color_discrete_sequence=["#8B0000", "#FFA500", "#2E8B57", "#FF6347", "#800000"],
+    title="Time in Ranges"
+)
+fig_bands.update_layout(yaxis_tickformat=".0%", xaxis_title=None)
+st.plotly_chart(fig_bands)
+
+# Glucose trace of the period, downsampled to a bounded number of points
+times, values = store.window(start, end)
+keep = plot_utils.minmax_downsample(times, values)
+fig_trace = go.Figure(plot_utils.scatter_trace_type(len(keep))(
+    x=pd.to_datetime(times[keep]),
+    y=values[keep],
+    mode="lines",
+    line=dict(color="#000080", width=1),
+    name="Glucose"
+))
+fig_trace.add_hrect(y0=cgm.LOW_GLUCOSE, y1=cgm.HIGH_GLUCOSE, fillcolor="#2E8B57", opacity=0.1, line_width=0)
+fig_trace.update_layout(title="Glucose Readings", xaxis_title="Date", yaxis_title="Glucose [mg/dL]")
+st.plotly_chart(fig_trace)
+
+with st.expander("📋 Daily metrics", expanded=False):
+    st.dataframe(
+        store.daily_metrics(start, end - pd.Timedelta(days=1)).drop(columns="End"),
+        hide_index=True,
+        column_config={
+            "Start": st.column_config.DateColumn("Day"),
+            "Coverage": st.column_config.NumberColumn(format="%.2f"),
+            "Mean Glucose": st.column_config.NumberColumn(format="%.0f"),
+            "GMI": st.column_config.NumberColumn(format="%.1f"),
+            "CV": st.column_config.NumberColumn(format="%.1f"),
+            **{band: st.column_config.NumberColumn(format="%.2f") for band in ["Very Low", "Low", "In Range", "High", "Very High"]}
+        }
+    )
@@ -0,0 +1,64 @@
+import re
+import time
+import streamlit as st
+import cohort
+
+st.title("Cohort")
+
+st.markdown("Load the IPS timelines of a group of patients, e.g. a clinic panel, for a combined review.")
+
+fhir_server_url = st.text_input("FHIR Server URL", st.session_state.get("fhir_server_url") or cohort.calculation_data.FHIR_BASE_URL)
+source = st.radio("Patients", ["Patient IDs", "FHIR Group"], horizontal=True)
+if source == "Patient IDs":
+    ids_text = st.text_area("Patient IDs (separated by comma, space or new line)")
+    group_id = None
+else:
+    ids_text = ""
+    group_id = st.text_input("Group ID")
+
+workers_col, connections_col = st.columns(2)
+with workers_col:
+    max_workers = st.slider("Worker processes", 1, 16, 4)
+with connections_col:
+    max_connections = st.slider("Connection budget", 1, 32, 8, help="Requests to the FHIR server that may run at the same time over all workers")
+
+if st.button("Load cohort"):
+    if group_id:
+        patient_ids = cohort.fetch_group_members(fhir_server_url, group_id)
+    else:
+        patient_ids = [patient_id for patient_id in re.split(r"[\s,;]+", ids_text) if patient_id]
+    if not patient_ids:
+        st.warning("No patients to load.")
+        st.stop()
+
+    progress_bar = st.progress(0.0, text=f"Loading {len(patient_ids)} patients...")
+    start = time.perf_counter()
+    cohort_df, timings_df = cohort.load_cohort(
+        patient_ids, fhir_server_url, max_workers=max_workers, max_connections=max_connections,
+        progress=lambda done, total: progress_bar.progress(done / total, text=f"Loaded {done} of {total} patients")
+    )
+    st.session_state.cohort_data = cohort_df
+    st.session_state.cohort_version = cohort.cohort_version(cohort_df, fhir_server_url)
+    st.session_state.cohort_timings = timings_df
+    st.session_state.cohort_seconds = time.perf_counter() - start
+    progress_bar.empty()
+
+if "cohort_data" in st.session_state:
+    cohort_df = st.session_state.cohort_data
+    timings_df = st.session_state.cohort_timings
+
+    st.markdown("---")
+    st.markdown(f"**Patients:** {len(timings_df)}")
+    st.markdown(f"**Events:** {len(cohort_df)}")
+    st.markdown(f"**Load time:** {st.session_state.cohort_seconds:.1f} s "
+                f"(sum over patients: {timings_df['Seconds'].sum():.1f} s)")
+
+    failed = timings_df[timings_df["Status"] != "Loaded"]
+    if not failed.empty:
+        st.warning(f"No composition found for {len(failed)} patients.")
+
+    with st.expander("⏱️ Load timings per patient"):
+        st.dataframe(timings_df, hide_index=True)
+
+    with st.expander("📋 Events per resource type"):
+        st.dataframe(cohort_df.groupby("Title", observed=True).size().rename("Events"))
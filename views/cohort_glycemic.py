@@ -0,0 +1,76 @@
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+import cohort
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_observations(cohort_version, _cohort_df):
+    """Glucose and HbA1c results of the loaded cohort, computed once per cohort content (cohort_version is its hash)"""
+    return cohort.glycemic_observations(_cohort_df)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_summary(cohort_version, start, end, _observations):
+    """Per patient statistics of the observations between start and end (inclusive)"""
+    dates = _observations["Date"]
+    # observations are sorted by date, so the window is a contiguous slice
+    first = dates.searchsorted(pd.Timestamp(start, tz="UTC"), side="left")
+    last = dates.searchsorted(pd.Timestamp(end, tz="UTC") + pd.Timedelta(days=1), side="left")
+    summary = cohort.glycemic_summary(_observations.iloc[first:last])
+    return summary, cohort.band_shares(summary)
+
+st.title("Cohort Glycemic Analytics")
+
+if "cohort_data" not in st.session_state:
+    st.warning("Please load a cohort first.")
+    st.stop()
+
+# content hash of the cohort, sessions with the same cohort share the cached results
+cohort_version = st.session_state.cohort_version
+observations = load_observations(cohort_version, st.session_state.cohort_data)
+if observations.empty:
+    st.warning("No glucose or HbA1c data available for this cohort.")
+    st.stop()
+
+st.sidebar.header("Filter Options")
+start_date = st.sidebar.date_input("Start Date", value=observations["Date"].iloc[0].date())
+end_date = st.sidebar.date_input("End Date", value=observations["Date"].iloc[-1].date())
+if start_date > end_date:
+    st.sidebar.error("Start Date must be earlier than End Date.")
+    st.stop()
+
+summary, shares = load_summary(cohort_version, start_date, end_date, observations)
+if summary.empty:
+    st.warning("No data available for the selected filters.")
+    st.stop()
+
+for analyte, unit in [("Glucose", "mg/dL"), ("HbA1c", "%")]:
+    analyte_summary = summary[summary["Analyte"] == analyte]
+    if analyte_summary.empty:
+        continue
+    st.markdown(f"### {analyte}")
+    patients_col, median_col, rising_col = st.columns(3)
+    patients_col.metric("Patients", len(analyte_summary))
+    median_col.metric("Median latest value", f"{analyte_summary['Latest'].median():.1f} {unit}")
+    rising_col.metric("Rising trend", f"{(analyte_summary['Slope per Year'] > 0).mean():.0%}")
+
+    fig = px.bar(
+        shares[shares["Analyte"] == analyte],
+        x="Share",
+        y="Band",
+        orientation="h",
+        text="Patients",
+        color_discrete_sequence=['#000080'],
+        labels={"Share": "Share of patients (latest value)", "Band": "ADA/EASD band"}
+    )
+    fig.update_layout(xaxis_tickformat=".0%", yaxis={"categoryorder": "array", "categoryarray": list(shares.loc[shares["Analyte"] == analyte, "Band"])})
+    st.plotly_chart(fig)
+
+with st.expander("📋 Patients", expanded=False):
+    st.dataframe(
+        summary.sort_values(["Analyte", "Latest"], ascending=[True, False]),
+        hide_index=True,
+        column_config={
+            "Latest": st.column_config.NumberColumn(format="%.1f"),
+            "Slope per Year": st.column_config.NumberColumn(format="%.2f")
+        }
+    )
@@ -2,48 +2,64 @@ import streamlit as st
 import requests
 from views.fhir_web import search_patient
 
-import folium
-from streamlit_folium import folium_static
-
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
-
-def get_location_coordinates(address_str):
+import streamlit.components.v1 as components
+
+import geocoding
+import map_cache
+
+def show_address_map(address_str, coordinates, width=400, height=300):
+    """Show the location of the address on a map, the rendered map is reused from the map cache"""
+    html, _ = map_cache.address_map_html(address_str, coordinates, width, height)
+    components.html(html, width=width, height=height + 10)
+
+    with st.expander("⏱️ Map cache"):
+        stats = map_cache.get_map_cache().stats()
+        st.markdown(f"**Hits:** {stats['Hits']} of {stats['Hits'] + stats['Misses']} ({stats['Hit Rate']:.0%})")
+        st.markdown(f"**Render time saved:** {stats['Saved Seconds'] * 1000:.0f} ms "
+                    f"(spent rendering: {stats['Render Seconds'] * 1000:.0f} ms)")
+        st.markdown(f"**Cached maps:** {stats['Entries']} (evicted: {stats['Evictions']})")
+
+@st.fragment
+def address_map(address_str):
+    """Map of a geocoded address, the address is known so nothing waits on the network"""
+    hit, coordinates = geocoding.cached_location(address_str)
+    if hit and coordinates:
+        show_address_map(address_str, coordinates)
+    else:
+        st.info("Location could not be displayed on map")
+
+@st.fragment(run_every=0.5)
+def pending_address_map():
     """
-    Get coordinates for an address using Nominatim geocoder.
-    
-    Args:
-        address_str (str): Address string to geocode
-    
-    Returns:
-        tuple: (latitude, longitude) or None if geocoding fails
+    Placeholder of the map while the address is geocoded in the background
+    The page reruns once the lookup is finished: the map is then drawn from the geocoding cache, or a failed
+    lookup is shown by the page, which stops this fragment from polling
     """
-    try:
-        import ssl
-        import certifi
-        
-        ctx = ssl.create_default_context(cafile=certifi.where())
-        geolocator = Nominatim(
-            user_agent="patient_search_portal",
-            ssl_context=ctx
-        )
-        
-        location = geolocator.geocode(address_str, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        return None
-    except (GeocoderTimedOut, GeocoderUnavailable) as e:
-        st.warning(f"Geocoding error: {e}")
-        return None
-    except Exception as e:
-        st.warning(f"Error getting coordinates: {e}")
-        return None
+    address_str, future = st.session_state.address_lookup
+    if not future.done():
+        st.caption("🗺️ Locating the address ...")
+        return
+    if future.exception() is not None:
+        st.session_state.address_lookup_error = (address_str, str(future.exception()))
+    del st.session_state.address_lookup
+    st.rerun()
+
+def failed_address_map(address_str, error):
+    """Error of the last lookup of the address, the lookup starts again on request"""
+    st.warning(f"Geocoding error: {error}")
+    st.info("Location could not be displayed on map")
+    if st.button("Retry locating the address"):
+        del st.session_state.address_lookup_error
+        st.rerun()
 
 st.session_state.current_page = "Demographics"
 
 st.title("Demographics")
 
-patient_data = search_patient(st.session_state.fhir_server_url,st.session_state.patient_id)
+# The Patient resource was stored by the patient search, ask the server only if it belongs to another patient
+patient_data = st.session_state.get("patient_resource")
+if not patient_data or patient_data.get("id") != st.session_state.patient_id:
+    patient_data = search_patient(st.session_state.fhir_server_url,st.session_state.patient_id)
 
 st.markdown("### 👤 Basic Info")
 name = patient_data.get('name', [{}])[0].get('given', ['N/A'])[0] + " " + \
@@ -75,6 +91,7 @@ st.markdown("### 📍 Address")
 # Create two columns for address and map
 addr_col, map_col = st.columns([1, 1])
 
+address_str = None
 address = patient_data.get('address', [{}])[0]
 if address:
     with addr_col:
@@ -99,46 +116,7 @@ if address:
     if country != 'N/A':
         address_parts.append(country)
     
-    if address_parts:
-        address_str = ", ".join(address_parts)
-        coordinates = get_location_coordinates(address_str)
-        
-        if coordinates:
-            with map_col:
-                # Create the map with improved styling
-                m = folium.Map(
-                    location=coordinates,
-                    zoom_start=15,
-                    width='100%',
-                    height='100%'
-                )
-                
-                # Add a marker with a popup containing the address
-                folium.Marker(
-                    coordinates,
-                    popup=folium.Popup(address_str, max_width=300),
-                    tooltip="Patient's Location",
-                    icon=folium.Icon(
-                        color='red',
-                        icon='info-sign',
-                        prefix='fa'
-                    )
-                ).add_to(m)
-                
-                # Add a circle around the location
-                folium.Circle(
-                    coordinates,
-                    radius=100,
-                    color='red',
-                    fill=True,
-                    fillOpacity=0.2
-                ).add_to(m)
-                
-                # Display the map with custom size
-                folium_static(m, width=400, height=300)  # Adjusted size for column
-        else:
-            with map_col:
-                st.info("Location could not be displayed on map")
+    address_str = ", ".join(address_parts)
 
 # Add some spacing
 st.markdown("---")
@@ -180,4 +158,20 @@ if 'communication' in patient_data:
             'Preferred': '✓' if preferred else '✗'
         })
     if comm_data:
-        st.table(comm_data)
\ No newline at end of file
+        st.table(comm_data)
+
+# The map is filled in last, after the rest of the page is shown
+if address_str:
+    with map_col:
+        hit, _ = geocoding.cached_location(address_str)
+        failed_lookup = st.session_state.get("address_lookup_error")
+        if hit:
+            address_map(address_str)
+        elif failed_lookup and failed_lookup[0] == address_str:
+            failed_address_map(*failed_lookup)
+        else:
+            # one lookup per address, a rerun of the page waits for the running one
+            lookup = st.session_state.get("address_lookup")
+            if lookup is None or lookup[0] != address_str:
+                st.session_state.address_lookup = (address_str, geocoding.locate_in_background(address_str))
+            pending_address_map()
@@ -1,97 +1,118 @@
 import streamlit as st
-from views.fhir_web import search_patient_resource
+from views.fhir_web import get_resource_graph, search_patient_resource
+
+import table_utils
+
+def encounter_type(encounter):
+    """Display of the first type coding with a display or a code, or its code"""
+    display = 'N/A'
+    type_codings = encounter.get('type', [{}])[0].get('coding', [])
+    for coding in type_codings:
+        if coding.get('display'):
+            display = coding.get('display')
+            break
+        elif coding.get('code'):
+            display = f"Code: {coding.get('code')}"
+            break
+    return display
 
 # Encounters Section
-with st.expander("🏥 Encounters", expanded=True):
-    encounters = search_patient_resource(st.session_state.fhir_server_url, st.session_state.patient_id, "Encounter")
-    if encounters:
-        encounters_data = []
-        for entry in encounters:
-            encounter = entry.get('resource', {})
-            
-            # Get encounter type from coding
-            encounter_type = 'N/A'
-            type_codings = encounter.get('type', [{}])[0].get('coding', [])
-            for coding in type_codings:
-                if coding.get('display'):
-                    encounter_type = coding.get('display')
-                    break
-                elif coding.get('code'):
-                    encounter_type = f"Code: {coding.get('code')}"
-                    break
+@st.fragment
+def encounters_section(fhir_server_url, patient_id):
+    """Encounters of the patient, latest first"""
+    with st.expander("🏥 Encounters", expanded=True):
+        encounters = search_patient_resource(fhir_server_url, patient_id, "Encounter")
+        if encounters:
+            encounters_data = []
+            for entry in encounters:
+                encounter = entry.get('resource', {})
             
-            # Get encounter class
-            class_code = encounter.get('class', {})
-            encounter_class = class_code.get('code', 'N/A')
-            if class_code.get('display'):
-                encounter_class = class_code.get('display')
+                # Get encounter class
+                class_code = encounter.get('class', {})
+                encounter_class = class_code.get('code', 'N/A')
+                if class_code.get('display'):
+                    encounter_class = class_code.get('display')
             
-            # Get service type if available
-            service_type = 'N/A'
-            if 'serviceType' in encounter:
-                service_codings = encounter['serviceType'].get('coding', [])
-                for coding in service_codings:
-                    if coding.get('display'):
-                        service_type = coding.get('display')
-                        break
+                # Get service type if available
+                service_type = 'N/A'
+                if 'serviceType' in encounter:
+                    service_codings = encounter['serviceType'].get('coding', [])
+                    for coding in service_codings:
+                        if coding.get('display'):
+                            service_type = coding.get('display')
+                            break
             
-            # Get service provider - handle both reference and display
-            service_provider = 'N/A'
-            provider_info = encounter.get('serviceProvider', {})
-            if 'display' in provider_info:
-                service_provider = provider_info['display']
-            elif 'reference' in provider_info:
-                service_provider = provider_info['reference'].split('/')[-1]
+                # Get service provider - handle both reference and display
+                service_provider = 'N/A'
+                provider_info = encounter.get('serviceProvider', {})
+                if 'display' in provider_info:
+                    service_provider = provider_info['display']
+                elif 'reference' in provider_info:
+                    service_provider = provider_info['reference'].split('/')[-1]
             
-            # Get period start and end dates
-            period = encounter.get('period', {})
-            start_date = period.get('start', 'N/A')
-            end_date = period.get('end', 'N/A')
+                # Get period start and end dates
+                period = encounter.get('period', {})
+                start_date = period.get('start', 'N/A')
+                end_date = period.get('end', 'N/A')
             
-            encounters_data.append({
-                'Type': encounter_type,
-                'Class': encounter_class,
-                'Service': service_type,
-                'Provider': service_provider,
-                'Start Date': start_date,
-                'End Date': end_date,
-                'Status': encounter.get('status', 'N/A')
-            })
+                encounters_data.append({
+                    'Type': encounter_type(encounter),
+                    'Class': encounter_class,
+                    'Service': service_type,
+                    'Provider': service_provider,
+                    'Start Date': start_date,
+                    'End Date': end_date,
+                    'Status': encounter.get('status', 'N/A')
+                })
         
-        # Sort encounters by start date
-        encounters_data.sort(key=lambda x: x['Start Date'] if x['Start Date'] != 'N/A' else '', reverse=True)
-        st.table(encounters_data)
+            # Sort encounters by start date
+            encounters_data.sort(key=lambda x: x['Start Date'] if x['Start Date'] != 'N/A' else '', reverse=True)
+            table_utils.paginated_table(encounters_data, key="encounters")
         
-        # Display total count
-        st.markdown(f"*Total encounters: {len(encounters_data)}*")
-    else:
-        st.info("No encounters recorded")
+            # Display total count
+            st.markdown(f"*Total encounters: {len(encounters_data)}*")
+        else:
+            st.info("No encounters recorded")
 
 # Procedures Section
-with st.expander("⚕️ Procedures", expanded=True):
-    procedures = search_patient_resource(st.session_state.fhir_server_url, st.session_state.patient_id, "Procedure")
-    if procedures:
-        procedures_data = []
-        for entry in procedures:
-            procedure = entry.get('resource', {})
+@st.fragment
+def procedures_section(fhir_server_url, patient_id):
+    """Procedures of the patient, latest first"""
+    with st.expander("⚕️ Procedures", expanded=True):
+        procedures = search_patient_resource(fhir_server_url, patient_id, "Procedure")
+        if procedures:
+            # only the procedures and their encounters, both searches are memoized already
+            graph = get_resource_graph(("Encounter", "Procedure"))
+            procedures_data = []
+            for entry in procedures:
+                procedure = entry.get('resource', {})
             
-            # Get performed period if available
-            performed_period = procedure.get('performedPeriod', {})
-            start_date = performed_period.get('start', procedure.get('performedDateTime', 'N/A'))
-            end_date = performed_period.get('end', 'N/A')
+                # Get performed period if available
+                performed_period = procedure.get('performedPeriod', {})
+                start_date = performed_period.get('start', procedure.get('performedDateTime', 'N/A'))
+                end_date = performed_period.get('end', 'N/A')
             
-            procedures_data.append({
-                'Procedure': procedure.get('code', {}).get('text', 'N/A'),
-                'Start Date': start_date,
-                'End Date': end_date,
-                'Status': procedure.get('status', 'N/A')
-            })
+                # the encounter is read from the resource graph, no request per procedure
+                encounter = graph.get(procedure.get('encounter', {}).get('reference', ''))
+                encounter_label = encounter_type(encounter) if encounter else 'N/A'
+
+                procedures_data.append({
+                    'Procedure': procedure.get('code', {}).get('text', 'N/A'),
+                    'Encounter': encounter_label,
+                    'Start Date': start_date,
+                    'End Date': end_date,
+                    'Status': procedure.get('status', 'N/A')
+                })
             
-        # Sort procedures by start date
-        procedures_data.sort(key=lambda x: x['Start Date'] if x['Start Date'] != 'N/A' else '', reverse=True)
-        st.table(procedures_data)
+            # Sort procedures by start date
+            procedures_data.sort(key=lambda x: x['Start Date'] if x['Start Date'] != 'N/A' else '', reverse=True)
+            table_utils.paginated_table(procedures_data, key="procedures")
         
-        # Display total count
-        st.markdown(f"*Total procedures: {len(procedures_data)}*")
-    else:
-        st.info("No procedures recorded")
\ No newline at end of file
+            # Display total count
+            st.markdown(f"*Total procedures: {len(procedures_data)}*")
+        else:
+            st.info("No procedures recorded")
+
+# The procedures fragment reads the encounters from the resource graph, not from the encounters fragment
+encounters_section(st.session_state.fhir_server_url, st.session_state.patient_id)
+procedures_section(st.session_state.fhir_server_url, st.session_state.patient_id)
@@ -6,7 +6,10 @@ from io import BytesIO
 from datetime import datetime
 from streamlit_qrcode_scanner import qrcode_scanner
 import calculation_data
+import resource_graph
+import section_loader
 import numpy as np
+import pandas as pd
 
 # Set page title and icon
 st.set_page_config(page_title="Patient Search", page_icon="🩺")
@@ -50,6 +53,8 @@ def search_patient(fhir_server_url, patient_id):
             
             # Obtener los datos del paciente
             patient_data = response.json()
+            # the Demographics page renders from this copy without asking the server again
+            st.session_state.patient_resource = patient_data
             
             # Mostrar mensaje de éxito si no estamos en medio de una recarga
             #if not st.session_state.get('_is_reloading'):
@@ -67,6 +72,21 @@ def search_patient(fhir_server_url, patient_id):
         return None
 
 
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_patient_resources(fhir_server_url, patient_id, resource_type):
+    """
+    Memoized search of the resources of a patient, shared by the sections and their reruns
+    The sections of the table pages run as fragments: a widget rerunning one section reads its resources
+    from here instead of searching again
+    Failed requests and error responses raise, so they are not cached
+    Returns:
+        list: Bundle entries
+    """
+    url = fhir_server_url + resource_type + "?patient=" + patient_id
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return response.json().get('entry', [])
+
 def search_patient_resource(fhir_server_url, patient_id, resource_type):
     """
     Generic function to search for any FHIR resource associated with a patient.
@@ -79,15 +99,106 @@ def search_patient_resource(fhir_server_url, patient_id, resource_type):
     """
     try:
         #url = f"https://ips-challenge.it.hs-heilbronn.de/fhir/{resource_type}?patient={patient_id}"
-        url = fhir_server_url + resource_type + "?patient=" + patient_id
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json().get('entry', [])
-        return []
+        return fetch_patient_resources(fhir_server_url, patient_id, resource_type)
     except requests.RequestException as e:
         st.error(f"Error fetching {resource_type}: {e}")
         return []
 
+# Resource types of the patient record searched by the views
+PATIENT_RESOURCE_TYPES = (
+    "Condition", "MedicationRequest", "AllergyIntolerance", "Immunization",
+    "Encounter", "Procedure", "Observation", "DiagnosticReport"
+)
+
+@st.cache_resource(show_spinner=False, ttl=60, max_entries=16)
+def patient_resource_graph(fhir_server_url, patient_id, resource_types=PATIENT_RESOURCE_TYPES, composition_version=None, _composition=None):
+    """
+    Resource graph of a patient, built in one pass over the memoized searches and the composition
+    Only the resource types a view asks for are searched
+    A failed search raises, so an incomplete graph is never cached
+    Args:
+        fhir_server_url (str): FHIR Server URL
+        patient_id (str): The patient's ID
+        resource_types (tuple): resource types of the patient to search and index
+        composition_version (str): versionId of the composition, part of the cache key
+        _composition (dict): composition of the patient, not hashed
+    Returns:
+        ResourceGraph: the resources indexed by ResourceType/id with forward and reverse references
+    """
+    graph = resource_graph.ResourceGraph()
+    for resource_type in resource_types:
+        graph.add_bundle(fetch_patient_resources(fhir_server_url, patient_id, resource_type))
+    if _composition:
+        graph.add(_composition)
+    return graph
+
+def get_resource_graph(resource_types=PATIENT_RESOURCE_TYPES):
+    """
+    Resource graph of the patient of the session, including the loaded composition
+    If a search fails the error is shown and a graph of the composition alone is returned, without caching it
+    Args:
+        resource_types (tuple): resource types the view needs, e.g. ("Encounter", "Procedure")
+    """
+    loader = st.session_state.get("section_loader")
+    composition = loader.composition if loader is not None else None
+    version = composition.get("meta", {}).get("versionId") if composition else None
+    try:
+        return patient_resource_graph(st.session_state.fhir_server_url, st.session_state.patient_id, tuple(resource_types), version, composition)
+    except requests.RequestException as e:
+        st.error(f"Error fetching the patient's resources: {e}")
+    # an uncached graph of the composition only, the next rerun searches again
+    graph = resource_graph.ResourceGraph()
+    if composition:
+        graph.add(composition)
+    return graph
+
+def resolve_from_graph(graph, fhir_server_url, patient_id, references, chunk_size=100):
+    """
+    Resources of references, read from the resource graph
+    The references missing in the graph are fetched with one search per resource type (_id=a,b,c),
+    not one read per reference, and added to the graph. Resource types of the patient record are
+    searched within the patient, and only the requested resources are added to the graph.
+    Args:
+        graph (ResourceGraph): resource graph of the patient
+        fhir_server_url (str): FHIR Server URL
+        patient_id (str): The patient's ID
+        references (list): references or resource keys
+        chunk_size (int): ids per search, keeps the URL short
+    Returns:
+        list: resources in the order of the references, None where a reference can not be resolved
+    """
+    missing = {}
+    for key in graph.missing(references):
+        resource_type, resource_id = key.split("/", 1)
+        missing.setdefault(resource_type, []).append(resource_id)
+    for resource_type, ids in missing.items():
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            keys = {f"{resource_type}/{resource_id}" for resource_id in chunk}
+            params = {"_id": ",".join(chunk), "_count": len(chunk)}
+            if resource_type in PATIENT_RESOURCE_TYPES:
+                params["patient"] = patient_id
+            url = f"{fhir_server_url}{resource_type}"
+            try:
+                # the server may return fewer resources per page than asked for, all pages are read
+                while url:
+                    response = requests.get(url, params=params, headers={"accept": "application/fhir+json"}, timeout=30)
+                    response.raise_for_status()
+                    bundle = response.json()
+                    graph.add_bundle([entry for entry in bundle.get("entry", [])
+                                      if resource_graph.resource_key(entry.get("resource", {})) in keys])
+                    url = next((link.get("url") for link in bundle.get("link", []) if link.get("relation") == "next"), None)
+                    params = None
+            except ValueError as e:
+                # a page that is not JSON, e.g. an HTML error page with status 200, will not get better on a rerun
+                st.error(f"Error reading {resource_type}: {e}")
+            except requests.RequestException as e:
+                st.error(f"Error fetching {resource_type}: {e}")
+                continue
+            # only a search read to its last page tells which ids do not exist
+            graph.mark_not_found(keys)
+    return [graph.get(reference) for reference in references]
+
 def process_observations(observations):
     """Process and group observations by category"""
     grouped_observations = {}
@@ -111,37 +222,23 @@ def process_observations(observations):
 
     return grouped_observations
 
-def get_location_coordinates(address_str):
+@st.cache_data(show_spinner=False, ttl=60)
+def observation_tables(fhir_server_url, patient_id):
     """
-    Get coordinates for an address using Nominatim geocoder.
-    
-    Args:
-        address_str (str): Address string to geocode
-    
-    Returns:
-        tuple: (latitude, longitude) or None if geocoding fails
+    Observation rows of the patient per category, built once per search and shared by the table pages
+    Failed searches raise, so they are not cached
     """
-    try:
-        import ssl
-        import certifi
-        
-        ctx = ssl.create_default_context(cafile=certifi.where())
-        geolocator = Nominatim(
-            user_agent="patient_search_portal",
-            ssl_context=ctx
-        )
-        
-        location = geolocator.geocode(address_str, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-        return None
-    except (GeocoderTimedOut, GeocoderUnavailable) as e:
-        st.warning(f"Geocoding error: {e}")
-        return None
-    except Exception as e:
-        st.warning(f"Error getting coordinates: {e}")
-        return None
+    observations = fetch_patient_resources(fhir_server_url, patient_id, "Observation")
+    return {category: pd.DataFrame(rows) for category, rows in process_observations(observations).items()}
 
+def clear_patient_resources():
+    """
+    Drop the memoized searches and the tables and resource graphs built from them, called after a write
+    to the FHIR server so the pages show a created resource right away instead of after the ttl
+    """
+    fetch_patient_resources.clear()
+    observation_tables.clear()
+    patient_resource_graph.clear()
 
 def generate_patient_qr(fhir_server_url, patient_id):
     """
@@ -167,49 +264,43 @@ def generate_patient_qr(fhir_server_url, patient_id):
     img_byte_arr.seek(0)
     return img_byte_arr
 
-def calculate_patient_data(patient_id):
+# Composition versions shown instead of the current one while st.session_state.history is set
+HISTORY_VERSIONS = {
+    "UC4-Patient": "51",  # Martas composition with the diabetes data
+}
+
+def calculate_patient_data(patient_id, version_id=None):
     """
     Get all the data from the IPS Composition of the given patient
     Needed for timeline and laboratory results
     Args:
         patient_id (str): The patient's ID
+        version_id (str): versionId of the Composition to visualize, None for the current version
     """
     # get data
     if patient_id:
 
-        resource = {}
-        composition_data = {}
+        composition_data = calculation_data.fetch_fhir_data(f"{calculation_data.FHIR_BASE_URL}Composition?patient={patient_id}")
+        if not composition_data or "entry" not in composition_data:
+            st.error("No data found for the patient. Please check the patient ID or data source.")
+            st.stop()
 
-        # if there is the history version to visualize diabetes data (just valued in code (manual))
-        if st.session_state.history and patient_id == "UC4-Patient":
-            resource = {}
-            composition_data = calculation_data.fetch_fhir_data(f"https://ips-challenge.it.hs-heilbronn.de/fhir/Composition?patient={patient_id}")
-            try:
-                composition_data = calculation_data.fetch_fhir_data("https://ips-challenge.it.hs-heilbronn.de/fhir/Composition/UC4-Composition/_history/51")
-            except Exception:
-                print("No history data of the patients composition available.")
-            if not composition_data:
-                st.error("No data found for the patient. Please check the patient ID or data source.")
-                st.stop()
+        resource = composition_data["entry"][0]["resource"]
 
-            if "entry" in composition_data:
-                resource = composition_data["entry"][0]["resource"]
-            else:
-                resource = composition_data
+        # if there is the history version to visualize diabetes data (just valued in code (manual))
+        if version_id is None and st.session_state.get("history"):
+            version_id = HISTORY_VERSIONS.get(patient_id)
 
+        if version_id is not None:
+            resource = calculation_data.fetch_composition_version(resource["id"], version_id)
             if not resource:
                 st.error("No data found for the patient. Please check the patient ID or data source.")
                 st.stop()
-        # else: other patient or we dont want to see the history version
-        else:
-            composition_data = calculation_data.fetch_fhir_data(f"https://ips-challenge.it.hs-heilbronn.de/fhir/Composition?patient={patient_id}")
-            if not composition_data or "entry" not in composition_data:
-                st.error("No data found for the patient. Please check the patient ID or data source.")
-                st.stop()
-
-            resource = composition_data["entry"][0]["resource"]
 
-        timeline_data = []
+        # the laboratory page may query the server directly only for the current version
+        st.session_state['composition_is_current'] = version_id is None
+        st.session_state['composition_id'] = resource.get("id")
+        st.session_state['composition_version'] = resource.get("meta", {}).get("versionId")
 
         # Loinc Code:             ...["code"]["Coding"][0]["code"]
 
@@ -231,36 +322,8 @@ def calculate_patient_data(patient_id):
         # Patient Story:           -
         # Plan of Care:            ?       CarePlan
 
-        for section in resource["section"]:
-            if section["code"]["coding"][0]["code"] == "10160-0" or\
-                section["code"]["coding"][0]["code"] == "11450-4" or\
-                section["code"]["coding"][0]["code"] == "30954-2" or\
-                section["code"]["coding"][0]["code"] == "48765-2" or\
-                section["code"]["coding"][0]["code"] == "8716-3" or\
-                section["code"]["coding"][0]["code"] == "29762-2":
-                for entry in section["entry"]:
-                    if "reference" in entry:
-                        clinical_data = calculation_data.search_for_clinical_data(entry["reference"])
-                        if section["code"]["coding"][0]["code"] == "10160-0": # Medication
-                            # MedicationStatement | MedicationRequest | MedicationAdministration | MedicationDispense
-                            calculation_data.extract_timeline_data_encounter(timeline_data, clinical_data)
-                        if section["code"]["coding"][0]["code"] == "11450-4": # Problems
-                            # Condition
-                            calculation_data.extract_timeline_data_condition(timeline_data, clinical_data)
-                        if section["code"]["coding"][0]["code"] == "30954-2": # Results
-                            # Observation | DiagnosticReport
-                            calculation_data.extract_timeline_data_observation(timeline_data, clinical_data)
-                        if section["code"]["coding"][0]["code"] == "48765-2": # Allergies
-                            # Allergy Intollerance
-                            calculation_data.extract_timeline_data_intolerance(timeline_data, clinical_data)
-                        if section["code"]["coding"][0]["code"] == "8716-3": # Vital
-                            # Observation
-                            calculation_data.extract_timeline_data_vital(timeline_data, clinical_data)
-                        if section["code"]["coding"][0]["code"] == "29762-2": # Social
-                            # Observation
-                            calculation_data.extract_timeline_data_history(timeline_data, clinical_data)
-
-        st.session_state['laboratory_data'] = timeline_data
+        # the sections are resolved in the background and on first access of the pages that consume them
+        section_loader.start_loading(resource)
 
 def main():
     """Main function to run the Streamlit app"""
@@ -0,0 +1,119 @@
+import streamlit as st
+import requests
+import calculation_data
+from views.fhir_web import calculate_patient_data
+
+def resolve_references(section_code, references):
+    """
+    Resolve only the given references of a section and extract their timeline information
+    Failed requests raise, so the callers do not cache them
+    Args:
+        section_code (str): LOINC code of the composition section
+        references (list): references to resolve
+    Returns:
+        list: one row per reference
+    """
+    rows = []
+    for reference in references:
+        clinical_data = calculation_data.fetch_clinical_data(reference)
+        extracted = []
+        calculation_data.extract_timeline_data(extracted, section_code, clinical_data)
+        for row in extracted or [{"Name": "Not available"}]:
+            rows.append({"Reference": reference, **row})
+    return rows
+
+@st.cache_data(show_spinner=False, max_entries=500)
+def resolve_versioned_changes(composition_id, older_version, newer_version, section_code, _changes):
+    """
+    Rows of the added and removed references of a section whose references are all versioned
+    The versions of the composition identify the changes and versioned resources never change, so there is no ttl
+    Args:
+        _changes (dict): {"Added", "Removed"} of diff_composition_sections, not hashed
+    Returns:
+        dict: "Added" and "Removed" -> rows of resolve_references
+    """
+    return {kind: resolve_references(section_code, _changes[kind]) for kind in ("Added", "Removed")}
+
+@st.cache_data(show_spinner=False, ttl=300, max_entries=500)
+def resolve_current_changes(composition_id, older_version, newer_version, section_code, _changes):
+    """Like resolve_versioned_changes for sections with unversioned references, which may change on the server"""
+    return {kind: resolve_references(section_code, _changes[kind]) for kind in ("Added", "Removed")}
+
+def format_version(version):
+    return f"Version {version['versionId']} ({version['lastUpdated']})"
+
+# Check if a patient is selected
+if "patient_id" not in st.session_state or not st.session_state.patient_id:
+    st.warning("Please select a patient first.")
+    st.stop()
+
+st.title("Composition History")
+
+composition_id = st.session_state.get("composition_id")
+if not composition_id:
+    composition_data = calculation_data.fetch_fhir_data(f"{calculation_data.FHIR_BASE_URL}Composition?patient={st.session_state.patient_id}")
+    if not composition_data or "entry" not in composition_data:
+        st.warning("No composition found for this patient.")
+        st.stop()
+    composition_id = composition_data["entry"][0]["resource"]["id"]
+
+try:
+    versions = calculation_data.fetch_composition_history(composition_id)
+except requests.RequestException as e:
+    st.error(f"Error fetching the composition history: {e}")
+    st.stop()
+if not versions:
+    st.warning("No history available for this composition.")
+    st.stop()
+
+st.markdown(f"**Composition:** {composition_id} — {len(versions)} versions")
+st.markdown(f"**Shown in timeline and laboratory:** version {st.session_state.get('composition_version', 'N/A')}")
+
+version_col, base_col = st.columns(2)
+with version_col:
+    selected = st.selectbox("Version", versions, format_func=format_version)
+with base_col:
+    base = st.selectbox("Compare with", versions, index=min(1, len(versions) - 1), format_func=format_version)
+
+if st.button(f"Show version {selected['versionId']} in timeline and laboratory"):
+    with st.spinner("Loading version..."):
+        calculate_patient_data(st.session_state.patient_id, selected["versionId"])
+    st.success(f"Version {selected['versionId']} loaded.")
+
+st.markdown("---")
+
+selected_composition = calculation_data.fetch_composition_version(composition_id, selected["versionId"])
+base_composition = calculation_data.fetch_composition_version(composition_id, base["versionId"])
+if not selected_composition or not base_composition:
+    st.stop()
+
+if selected["versionId"] == base["versionId"]:
+    st.info("Select two different versions to see the changes.")
+    st.stop()
+
+# versions are sorted newest first, compare the older against the newer one so "added" means added over time
+older, newer = base_composition, selected_composition
+older_version, newer_version = base["versionId"], selected["versionId"]
+if versions.index(base) < versions.index(selected):
+    older, newer = selected_composition, base_composition
+    older_version, newer_version = newer_version, older_version
+
+diff = calculation_data.diff_composition_sections(older, newer)
+if not diff:
+    st.info("The section references of both versions are identical.")
+
+for section_code, changes in diff.items():
+    with st.expander(f"{changes['Title']} (+{len(changes['Added'])} / -{len(changes['Removed'])})", expanded=True):
+        versioned = all("/_history/" in reference for reference in changes["Added"] + changes["Removed"])
+        resolve = resolve_versioned_changes if versioned else resolve_current_changes
+        try:
+            rows = resolve(composition_id, older_version, newer_version, section_code, changes)
+        except requests.RequestException as e:
+            st.error(f"Error fetching data: {e}")
+            continue
+        if changes["Added"]:
+            st.markdown("**Added**")
+            st.table(rows["Added"])
+        if changes["Removed"]:
+            st.markdown("**Removed**")
+            st.table(rows["Removed"])
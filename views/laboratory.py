@@ -1,6 +1,15 @@
 import streamlit as st
+import requests
 import pandas as pd
 import plotly.express as px
+import calculation_data
+import lab_data
+import lab_panel
+import plot_utils
+import section_loader
+
+# IPS sections consumed by this page: Results Summary
+SECTIONS = ["30954-2"]
 
 # Educational and descriptive section
 st.markdown("""
@@ -31,178 +40,195 @@ These guidelines provide international standards for diabetes diagnosis and moni
 ---
 """)
 
-def get_glucose_advice(value):
-    if value < low_glucose:
-        return "⚠️ **Caution**: Low glucose level. Consult your doctor to adjust your treatment and prevent hypoglycemic episodes."
-    elif low_glucose <= value < mid_glucose:
-        return "✅ **Excellent**: Your glucose levels are in the normal range."
-    elif mid_glucose <= value < high_glucose:
-        return "⚠️ **Attention**: Your levels indicate prediabetes. Consult your doctor about prevention strategies and lifestyle changes."
-    else:
-        return "🚨 **Important**: Your levels indicate diabetes. It is essential to maintain regular follow-up with your medical team."
-
-def get_hba1c_advice(value):
-    if value < normal_hemo:
-        return "✅ **Excellent**: Your long-term glycemic control is in the normal range."
-    elif normal_hemo <= value < mid_hemo:
-        return "⚠️ **Attention**: Your levels indicate prediabetes. It's important to implement lifestyle changes and consult with your doctor."
-    elif mid_hemo <= value < high_hemo:
-        return "🔍 **Follow-up**: Your levels indicate diabetes. Maintain regular monitoring and follow your medical team's recommendations."
-    else:
-        return "🚨 **Important**: Your glycemic control needs attention. Consult your doctor to adjust your treatment plan."
+# Advice per band of the latest value of the analytes with ADA/EASD guidelines
+GLUCOSE_ADVICE = dict(zip(calculation_data.GLUCOSE_LABELS, [
+    "⚠️ **Caution**: Low glucose level. Consult your doctor to adjust your treatment and prevent hypoglycemic episodes.",
+    "✅ **Excellent**: Your glucose levels are in the normal range.",
+    "⚠️ **Attention**: Your levels indicate prediabetes. Consult your doctor about prevention strategies and lifestyle changes.",
+    "🚨 **Important**: Your levels indicate diabetes. It is essential to maintain regular follow-up with your medical team."
+]))
+HBA1C_ADVICE = dict(zip(calculation_data.HBA1C_LABELS, [
+    "✅ **Excellent**: Your long-term glycemic control is in the normal range.",
+    "⚠️ **Attention**: Your levels indicate prediabetes. It's important to implement lifestyle changes and consult with your doctor.",
+    "🔍 **Follow-up**: Your levels indicate diabetes. Maintain regular monitoring and follow your medical team's recommendations.",
+    "🚨 **Important**: Your glycemic control needs attention. Consult your doctor to adjust your treatment plan."
+]))
+GLUCOSE_CODE = "14749-6"
+HBA1C_CODE = "4548-4"
+ADVICE = {GLUCOSE_CODE: GLUCOSE_ADVICE, HBA1C_CODE: HBA1C_ADVICE}
 
 # Check if a patient is selected
 if "patient_id" not in st.session_state or not st.session_state.patient_id:
     st.warning("Please select a patient first.")
     st.stop()
 
+# Only the recent lab results are needed: ask the server for the latest results of every analyte
+# ($lastn, or one sorted search of all configured analytes), use the data of the IPS Composition
+# if the server can not answer or a history version is shown
+timeline_data = None
+if st.session_state.get('composition_is_current', True):
+    try:
+        timeline_data = lab_data.fetch_lab_series(
+            st.session_state.get('fhir_server_url') or calculation_data.FHIR_BASE_URL,
+            st.session_state.patient_id,
+            tuple(lab_panel.ANALYTES)
+        )
+    except requests.RequestException as e:
+        st.warning(f"Error fetching the laboratory results, showing the IPS Composition: {e}")
+if timeline_data:
+    data_version = calculation_data.data_version(timeline_data)
+else:
+    timeline_data = section_loader.get_timeline_data(SECTIONS)
+    data_version = section_loader.get_data_version(SECTIONS)
+
 # Check if laboratory data is available
-timeline_data = st.session_state.get('laboratory_data', None)
 if timeline_data is None or len(timeline_data) == 0:
     st.warning("No laboratory data available for this patient.")
     st.stop()
 
-# Reference values according to ADA/EASD
-low_glucose = 70  # mg/dL - normal lower limit
-mid_glucose = 100  # mg/dL - prediabetes onset
-high_glucose = 126  # mg/dL - diabetes diagnosis
-
-# HbA1c values according to ADA/EASD
-normal_hemo = 5.7  # % - normal upper limit
-mid_hemo = 6.5  # % - diabetes diagnosis
-high_hemo = 8.0  # % - poor control
-
 st.title("Laboratory Results")
 
-def print_diagram_glucose(data):
-    df = pd.DataFrame(data)
-    
-    if 'Date' not in df.columns:
-        st.error("No date information found in the data")
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_lab_panel(data_version, _data):
+    """Lab results of the patient indexed by LOINC code, built once per data version for all charts"""
+    return lab_panel.LabPanel.from_timeline_data(_data)
+
+def visible_points(df, start_date, end_date):
+    """
+    Rows of the selected date range, downsampled to a bounded number of points
+    Minimum and maximum of every time bucket are kept, a narrower range shows the full resolution
+    """
+    first = df['Date'].searchsorted(pd.Timestamp(start_date), side='left')
+    last = df['Date'].searchsorted(pd.Timestamp(end_date) + pd.Timedelta(days=1), side='left')
+    visible = df.iloc[first:last]
+    keep = plot_utils.minmax_downsample(visible['Date'].to_numpy(), visible['Value'].to_numpy())
+    if len(keep) < len(visible):
+        st.caption(f"Showing {len(keep)} of {len(visible)} values. Narrow the date range to see all of them.")
+    return visible.iloc[keep].copy()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def lab_rolling_statistics(data_version, code, windows, statistics, _panel):
+    """Rolling statistics of one analyte of the patient, computed once per data version and selection"""
+    series = _panel.series(code)
+    return lab_data.rolling_statistics(series['Date'], series['Value'], windows, statistics)
+
+def add_rolling_traces(fig, rolling, start_date, end_date):
+    """Overlay every statistic column of a rolling statistics frame on a chart, within the selected date range"""
+    visible = rolling[(rolling['Date'] >= pd.Timestamp(start_date)) & (rolling['Date'] < pd.Timestamp(end_date) + pd.Timedelta(days=1))]
+    for column in visible.columns.drop('Date'):
+        keep = plot_utils.minmax_downsample(visible['Date'].to_numpy(), visible[column].to_numpy())
+        fig.add_trace(plot_utils.scatter_trace_type(len(keep))(
+            x=visible['Date'].iloc[keep],
+            y=visible[column].iloc[keep],
+            mode='lines',
+            name=column,
+            line=dict(width=2, dash='dot' if column.endswith('Median') else 'solid')
+        ))
+
+def latest_rolling_means(rolling, unit):
+    """Markdown line with the latest value of every rolling mean"""
+    means = [column for column in rolling.columns if column.endswith('Mean')]
+    if rolling.empty or not means:
+        return None
+    return " · ".join(f"{column}: **{rolling[column].iloc[-1]:.1f} {unit}**" for column in means)
+
+def analyte_name(code, series):
+    """Display name of an analyte: the configured one, else the name of its latest result"""
+    return lab_panel.ANALYTES.get(code, {}).get("Name") or series['Name'].iloc[-1] or code
+
+# The charts are memoized on the data version, the selected date range and the rolling statistics,
+# so they are replayed from the cache when only unrelated widgets change
+@st.cache_data(show_spinner=False, max_entries=64)
+def print_diagram_analyte(data_version, code, start_date, end_date, windows, statistics, show_overlay, _panel, _rolling, _overlay=None):
+    series = _panel.series(code)
+    if series.empty:
+        st.info(f"No results of LOINC {code} available.")
         return
-        
-    try:
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-        
-        if df['Date'].isna().any():
-            st.warning("Some dates could not be parsed correctly")
-            df = df.dropna(subset=['Date'])
-        
-        if df.empty:
-            st.info("No valid data available after date processing")
-            return
-
-        glucose_df = df[df['Title'] == "Results - Glucose Level"]
-
-        if not glucose_df.empty:
-            glucose_df['Color'] = "Neutral"
-            glucose_df['Symbol'] = "circle"
-            glucose_df.loc[:, 'Exact Date'] = glucose_df['Date'].dt.strftime('%B %d, %Y')
-            glucose_df['Value'] = glucose_df['Value'].str.extract(r'(\d+\.?\d*)').astype(float)
-            glucose_df['Status'] = glucose_df['Value'].apply(
-                lambda x: f'Hypoglycemia (< {low_glucose} mg/dL)' if x < low_glucose else (
-                    f'Normal ({low_glucose}-{mid_glucose-1} mg/dL)' if low_glucose <= x < mid_glucose else (
-                    f'Prediabetes ({mid_glucose}-{high_glucose-1} mg/dL)' if mid_glucose <= x < high_glucose else 
-                    f'Diabetes (≥ {high_glucose} mg/dL)')
-            ))
-
-            fig_glucose = px.line(
-                glucose_df,
-                x="Date",
-                y="Value",
-                color_discrete_sequence=['#000080'],
-                markers=True,
-                labels={"Value": "Fasting Glucose [mg/dL]", "Date": "Date"},
-                title="Glucose Levels Over Time",
-                hover_data=["Exact Date", "Status"]
-            )
-            
-            fig_glucose.update_traces(marker=dict(size=10))
-            fig_glucose.update_traces(mode='markers')
-
-            min_date = glucose_df['Date'].min()
-            max_date = glucose_df['Date'].max()
-            buffer_days = (max_date - min_date) * 0.05
-            min_date_with_buffer = min_date - buffer_days
-            max_date_with_buffer = max_date + buffer_days
-
-            fig_glucose.update_layout(showlegend=True)
-            st.plotly_chart(fig_glucose)
-            
-            # Show advice based on the latest value
-            latest_value = glucose_df['Value'].iloc[-1]
-            st.markdown("### Recommendation")
-            st.markdown(get_glucose_advice(latest_value))
-        else:
-            st.info("No glucose data available.")
-    except Exception as e:
-        st.error(f"Error processing glucose data: {e}")
-
-def print_diagram_hemoglobin(data):
-    df = pd.DataFrame(data)
-    
-    if 'Date' not in df.columns:
-        st.error("No date information found in the data")
+
+    name = analyte_name(code, series)
+    settings = lab_panel.ANALYTES.get(code, {})
+    unit = series['Unit'].iloc[-1]
+    latest = series.iloc[-1]
+    visible = visible_points(series, start_date, end_date)
+    if visible.empty:
+        st.info(f"No {name} data in the selected date range.")
         return
-        
-    try:
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-        
-        if df['Date'].isna().any():
-            st.warning("Some dates could not be parsed correctly")
-            df = df.dropna(subset=['Date'])
-        
-        if df.empty:
-            st.info("No valid data available after date processing")
-            return
-
-        hemoglobin_df = df[df['Title'] == "Results - Ac1-Test"]
-        
-        if not hemoglobin_df.empty:
-            hemoglobin_df['Value'] = hemoglobin_df['Value'].str.extract(r'(\d+\.?\d*)').astype(float)
-            hemoglobin_df['Exact Date'] = hemoglobin_df['Date'].dt.strftime('%B %d, %Y')
-            
-            def categorize_hba1c(value):
-                if value < normal_hemo:
-                    return f'Normal (< {normal_hemo}%)'
-                elif normal_hemo <= value < mid_hemo:
-                    return f'Prediabetes ({normal_hemo}-{mid_hemo-0.1}%)'
-                elif mid_hemo <= value < high_hemo:
-                    return f'Controlled Diabetes ({mid_hemo}-{high_hemo-0.1}%)'
-                else:
-                    return f'Uncontrolled Diabetes (≥ {high_hemo}%)'
-
-            hemoglobin_df['Status'] = hemoglobin_df['Value'].apply(categorize_hba1c)
-
-            fig_hemoglobin = px.line(
-                hemoglobin_df,
-                x="Date",
-                y="Value",
-                color_discrete_sequence=['#000080'],
-                markers=True,
-                labels={"Value": "HbA1c [%]", "Date": "Date"},
-                title="Glycated Hemoglobin (HbA1c) Over Time",
-                hover_data=["Exact Date", "Status"]
-            )
-            
-            fig_hemoglobin.update_traces(marker=dict(size=10), mode='markers')
-
-            min_date = hemoglobin_df['Date'].min()
-            max_date = hemoglobin_df['Date'].max()
-            buffer_days = pd.Timedelta(days=(max_date - min_date).days * 0.05)
-            min_date_with_buffer = min_date - buffer_days
-            max_date_with_buffer = max_date + buffer_days
-
-            st.plotly_chart(fig_hemoglobin)
-            
-            # Show advice based on the latest value
-            latest_value = hemoglobin_df['Value'].iloc[-1]
-            st.markdown("### Recommendation")
-            st.markdown(get_hba1c_advice(latest_value))
-        else:
-            st.info("No HbA1c data available.")
-    except Exception as e:
-        st.error(f"Error processing HbA1c data: {e}")
-
-print_diagram_glucose(timeline_data)
-print_diagram_hemoglobin(timeline_data)
\ No newline at end of file
+    visible['Exact Date'] = visible['Date'].dt.strftime('%B %d, %Y')
+
+    fig = px.line(
+        visible,
+        x="Date",
+        y="Value",
+        color_discrete_sequence=['#000080'],
+        markers=True,
+        labels={"Value": f"{settings.get('Axis', name)} [{unit}]", "Date": "Date"},
+        title=settings.get("Chart", f"{name} Over Time"),
+        hover_data=["Exact Date", "Reported", "Status"],
+        render_mode=plot_utils.render_mode(len(visible))
+    )
+    fig.update_traces(marker=dict(size=10), mode='markers', name=name, showlegend=True)
+    # reference range of the latest result
+    if pd.notna(latest['Low']) or pd.notna(latest['High']):
+        fig.add_hrect(
+            y0=latest['Low'] if pd.notna(latest['Low']) else visible['Value'].min(),
+            y1=latest['High'] if pd.notna(latest['High']) else visible['Value'].max(),
+            fillcolor="#2E8B57", opacity=0.1, line_width=0
+        )
+    add_rolling_traces(fig, _rolling, start_date, end_date)
+    if show_overlay:
+        add_rolling_traces(fig, _overlay, start_date, end_date)
+    fig.update_layout(showlegend=True)
+    st.plotly_chart(fig)
+
+    # Show advice based on the latest value
+    advice = ADVICE.get(code, {}).get(latest['Band'])
+    if advice:
+        st.markdown("### Recommendation")
+        st.markdown(advice)
+    elif latest['Status']:
+        st.markdown(f"Latest result: **{latest['Value']:.1f} {unit}** ({latest['Status']})")
+    trend = latest_rolling_means(_rolling, unit)
+    if trend:
+        st.markdown(f"Latest rolling means: {trend}")
+
+panel, left_out = load_lab_panel(data_version, timeline_data)
+if not left_out.empty:
+    st.warning(f"{len(left_out)} results have a unit that can not be converted and are not shown.")
+    with st.expander("Results with unknown units", expanded=False):
+        st.dataframe(left_out, hide_index=True)
+if not len(panel):
+    st.warning("No laboratory data with a valid date available for this patient.")
+    st.stop()
+
+analytes = panel.analytes()
+analyte_labels = {row.Code: f"{row.Name} ({row.Unit})" for row in analytes.itertuples()}
+
+# Sidebar filters: the charts show the values of this range
+st.sidebar.header("Filter Options")
+first_date, last_date = panel.date_range()
+start_date = st.sidebar.date_input("Start Date", value=first_date.date())
+end_date = st.sidebar.date_input("End Date", value=last_date.date())
+if start_date > end_date:
+    st.sidebar.error("Start Date must be earlier than End Date.")
+    st.stop()
+
+default_codes = [code for code in (GLUCOSE_CODE, HBA1C_CODE) if code in analyte_labels] or list(analyte_labels)[:2]
+selected_codes = st.sidebar.multiselect("Analytes", list(analyte_labels), default=default_codes, format_func=analyte_labels.get)
+windows = tuple(st.sidebar.multiselect("Rolling windows (days)", lab_data.ROLLING_WINDOWS, default=[30]))
+statistics = tuple(st.sidebar.multiselect("Rolling statistics", lab_data.ROLLING_STATISTICS, default=["Mean"]))
+show_estimated = st.sidebar.checkbox("Estimated HbA1c from the 90-day mean glucose", value=True)
+
+for code in selected_codes:
+    overlay = None
+    if code == HBA1C_CODE and show_estimated:
+        glucose_mean = lab_rolling_statistics(data_version, GLUCOSE_CODE, (90,), ("Mean",), panel)
+        overlay = pd.DataFrame({
+            'Date': glucose_mean['Date'],
+            'Estimated HbA1c': lab_data.estimated_hba1c(glucose_mean['90-day Mean'])
+        })
+    rolling = lab_rolling_statistics(data_version, code, windows, statistics, panel)
+    print_diagram_analyte(data_version, code, start_date, end_date, windows, statistics,
+                          code == HBA1C_CODE and show_estimated, panel, rolling, overlay)
+
+with st.expander("📋 Analytes", expanded=False):
+    st.dataframe(analytes, hide_index=True)
@@ -1,6 +1,8 @@
 import streamlit as st
 import requests
 
+from views.fhir_web import clear_patient_resources
+
 st.markdown("### 📝 Register New Clinical Event")
 
 def validate(fhir_server_url, resource_type, payload):
@@ -76,6 +78,7 @@ def add_to_composition(fhir_server_url, patient_id, res, resource_name, section_
 
 
         if update_response.status_code == 200:
+            clear_patient_resources()
             print("Composition updated successfully.")
             return True
         else:
@@ -130,7 +133,10 @@ def create_encounter(fhir_server_url, patient_id, event_data):
             headers={"Content-Type": "application/fhir+json"}
         )
         
-        return response.status_code == 201
+        if response.status_code != 201:
+            return False
+        clear_patient_resources()
+        return True
     except requests.RequestException as e:
         st.error(f"Error creating clinical event: {str(e)}")
         return False
@@ -176,6 +182,7 @@ def create_condition(fhir_server_url, patient_id, condition_data):
 
         if response.status_code != 201:
             return False
+        clear_patient_resources()
         print(f"created condition with id: {response.json()['id']}")
         composition_success = add_to_composition(fhir_server_url, patient_id, response, "Condition", "Problems Summary")
         if not composition_success:
@@ -231,6 +238,7 @@ def create_observation(fhir_server_url, patient_id, observation_data):
         )
         if response.status_code != 201:
             return False
+        clear_patient_resources()
         print(f"created observation with id: {response.json()['id']}")
         composition_success = add_to_composition(fhir_server_url, patient_id, response, "Observation", "Results Summary")
         if not composition_success:
@@ -266,7 +274,10 @@ def create_diagnostic_report(fhir_server_url, patient_id, report_data):
             json=report_resource,
             headers={"Content-Type": "application/fhir+json"}
         )
-        return response.status_code == 201
+        if response.status_code != 201:
+            return False
+        clear_patient_resources()
+        return True
     except requests.RequestException as e:
         st.error(f"Error creating diagnostic report: {str(e)}")
         return False
@@ -305,6 +316,7 @@ def create_medication_request(fhir_server_url, patient_id, medication_request_da
         )
         if response.status_code != 201:
             return False
+        clear_patient_resources()
         print(f"created medication request with id: {response.json()['id']}")
         composition_success = add_to_composition(fhir_server_url, patient_id, response, "MedicationRequest", "Medication Summary")
         if not composition_success:
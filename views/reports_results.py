@@ -1,31 +1,100 @@
+import requests
 import streamlit as st
 
-from views.fhir_web import search_patient_resource, process_observations
+from views.fhir_web import get_resource_graph, observation_tables, resolve_from_graph, search_patient_resource
+
+import table_utils
 
 # Observations Section
-observations = search_patient_resource(st.session_state.fhir_server_url, st.session_state.patient_id, "Observation")
-grouped_obs = process_observations(observations)
+@st.fragment
+def observations_section(fhir_server_url, patient_id):
+    """Observations of the patient grouped by category"""
+    try:
+        grouped_obs = observation_tables(fhir_server_url, patient_id)
+    except requests.RequestException as e:
+        st.error(f"Error fetching Observation: {e}")
+        return
 
-for category, obs_data in grouped_obs.items():
-    with st.expander(f"📊 {category} Observations", expanded=True):
-        st.table(obs_data)
+    for category, obs_data in grouped_obs.items():
+        with st.expander(f"📊 {category} Observations", expanded=True):
+            table_utils.paginated_table(obs_data, key=f"observations_{category}")
 
-if not grouped_obs:
-    st.info("No observations recorded")
+    if not grouped_obs:
+        st.info("No observations recorded")
 
-# Diagnostic Reports Section
-with st.expander("📋 Diagnostic Reports", expanded=True):
-    reports = search_patient_resource(st.session_state.fhir_server_url, st.session_state.patient_id, "DiagnosticReport")
-    if reports:
-        reports_data = []
-        for entry in reports:
-            report = entry.get('resource', {})
-            reports_data.append({
-                'Report': report.get('code', {}).get('text', 'N/A'),
-                'Date': report.get('effectiveDateTime', 'N/A'),
-                'Status': report.get('status', 'N/A'),
-                'Category': report.get('category', [{}])[0].get('text', 'N/A')
+def show_report_details(report, results):
+    """Result Observations and presentedForm metadata of one report"""
+    found = [result for result in results if result is not None]
+    st.markdown(f"**Results:** {len(found)}")
+    if found:
+        rows = []
+        for obs in found:
+            rows.append({
+                'Test': obs.get('code', {}).get('text',
+                       obs.get('code', {}).get('coding', [{}])[0].get('display', 'N/A')),
+                'Value': f"{obs.get('valueQuantity', {}).get('value', 'N/A')} {obs.get('valueQuantity', {}).get('unit', '')}",
+                'Date': obs.get('effectiveDateTime', 'N/A'),
+                'Status': obs.get('status', 'N/A')
             })
-        st.table(reports_data)
-    else:
-        st.info("No diagnostic reports recorded")
\ No newline at end of file
+        table_utils.paginated_table(rows, key="diagnostic_report_results")
+    if len(found) < len(results):
+        st.caption(f"{len(results) - len(found)} referenced results could not be found on the server")
+
+    forms = report.get('presentedForm', [])
+    if forms:
+        st.markdown(f"**Presented forms:** {len(forms)}")
+        # metadata of the attachments, the attached data itself is not shown
+        forms_data = []
+        for form in forms:
+            forms_data.append({
+                'Title': form.get('title', 'N/A'),
+                'Content Type': form.get('contentType', 'N/A'),
+                'Language': form.get('language', 'N/A'),
+                'Size': form.get('size', 'N/A'),
+                'Created': form.get('creation', 'N/A'),
+                'URL': form.get('url', 'N/A'),
+                'Embedded': 'data' in form
+            })
+        st.dataframe(forms_data, hide_index=True, use_container_width=True)
+
+# Diagnostic Reports Section
+@st.fragment
+def diagnostic_reports_section(fhir_server_url, patient_id):
+    """Diagnostic reports of the patient, with their results resolved from the resource graph"""
+    with st.expander("📋 Diagnostic Reports", expanded=True):
+        reports = search_patient_resource(fhir_server_url, patient_id, "DiagnosticReport")
+        if reports:
+            report_resources = [entry.get('resource', {}) for entry in reports]
+            # the results of all reports are resolved at once, missing ones with one search per resource type
+            references = [[result.get('reference', '') for result in report.get('result', [])] for report in report_resources]
+            graph = get_resource_graph(("DiagnosticReport", "Observation"))
+            resolved = iter(resolve_from_graph(graph, fhir_server_url, patient_id,
+                                               [reference for report_references in references for reference in report_references]))
+            results = [[next(resolved) for _ in report_references] for report_references in references]
+
+            reports_data = []
+            for report, report_results in zip(report_resources, results):
+                reports_data.append({
+                    'Report': report.get('code', {}).get('text', 'N/A'),
+                    'Date': report.get('effectiveDateTime', 'N/A'),
+                    'Status': report.get('status', 'N/A'),
+                    'Category': report.get('category', [{}])[0].get('text', 'N/A'),
+                    'Results': sum(result is not None for result in report_results),
+                    'Forms': len(report.get('presentedForm', []))
+                })
+            table_utils.paginated_table(reports_data, key="diagnostic_reports")
+
+            # expanders can not be nested, the details of one report at a time are shown below the table
+            choice = st.selectbox(
+                "Show report", range(len(reports_data)), index=None, placeholder="Choose a report",
+                format_func=lambda i: f"{reports_data[i]['Report']} ({reports_data[i]['Date']})",
+                key="diagnostic_report_detail"
+            )
+            if choice is not None:
+                show_report_details(report_resources[choice], results[choice])
+        else:
+            st.info("No diagnostic reports recorded")
+
+# Choosing a report reruns only the diagnostic reports fragment, the observation tables are left as they are
+observations_section(st.session_state.fhir_server_url, st.session_state.patient_id)
+diagnostic_reports_section(st.session_state.fhir_server_url, st.session_state.patient_id)
@@ -1,9 +1,20 @@
+import re
+import time
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+import plot_utils
+import section_loader
+import table_utils
+from timeline_index import TimelineIndex, TimelineAggregates, parse_dates, pick_resolution
+
+# IPS sections consumed by this page: all of them
+SECTIONS = section_loader.ALL_SECTIONS
 
 patient_id = st.session_state.get('patient_id', None)
-timeline_data = st.session_state.get('laboratory_data', None)
+timeline_data = section_loader.get_timeline_data(SECTIONS)
 
 low_glucose = 60 # mg/dL
 mid_glucose = 100 # mg/dL
@@ -11,37 +22,120 @@ high_glucose = 140 # mg/dL
 mid_hemo = 6.5 # percent = 7,75 mmol/l = 47 mmol/mol
 high_hemo = 8.5 # percent = 11 mmol/l = 69 mmol/mol
 
-# Hilfsfunktion zur Erstellung von Name-Value-Paaren für eine beliebige Anzahl
-def generate_custom_data(row):
-    # Beginne mit den Basisfeldern
-    hover_lines = [f"Exact Date: {row['Exact Date']}" if 'Exact Date' in row and row['Exact Date'] else ""]
-    if 'Name' in row and pd.notna(row['Name']):
-        hover_lines.append(f"Name: {row['Name']}")
-    if 'Value' in row and pd.notna(row['Value']):
-        hover_lines.append(f"Value: {row['Value']}")
-    # Dynamisch Name-Value-Paare hinzufügen
-    for i in range(5):  # Passe die maximale Anzahl von Paaren an
-        name_key = f"Name {i}"
-        value_key = f"Value {i}"
-        name = row.get(name_key, None)
-        value = row.get(value_key, None)
-        # Füge das Paar nur hinzu, wenn beide Werte existieren und nicht NaN sind
-        if pd.notna(name) and pd.notna(value):
-            hover_lines.append(f"{name}: {value}")
-    # Entferne leere Zeilen und erstelle einen zusammenhängenden String
-    return "<br>".join(hover_lines) if hover_lines else None
-
-def print_timeline(data):
-    # Verify the user's role
-    if not st.session_state.patient_id:
-        st.warning("No patient found.")
-        st.stop()
+# Columns of the timeline rows used by the lab panel and the search, not shown for entries without a date
+NO_DATE_HIDDEN_COLUMNS = ['Code', 'Reference Low', 'Reference High']
+# Columns of the search results, the ones present in the matching rows are shown
+SEARCH_COLUMNS = ['Title', 'Name', 'Date', 'Value', 'Code', 'Note', 'Reaction']
+# Days shown before and after a search match chosen on the timeline
+JUMP_DAYS = 30
 
-    st.title("Clinical Timeline")
+def hover_fields(df):
+    """
+    Hover lines available in the timeline DataFrame
+    Vital signs with components have the columns Name 1..N and Value 1..N, all of them are shown
+    :param df: timeline DataFrame
+    :return: list of (line template with {} for the values, columns of the values)
+    """
+    fields = [(f"{column}: {{}}", [column]) for column in ['Exact Date', 'Name', 'Value'] if column in df.columns]
+    component_ids = sorted(int(match.group(1)) for match in (re.fullmatch(r"Name (\d+)", str(c)) for c in df.columns) if match)
+    fields += [("{}: {}", [f"Name {idx}", f"Value {idx}"]) for idx in component_ids if f"Value {idx}" in df.columns]
+    return fields
+
+def build_timeline_figure(df):
+    """
+    Plot the timeline with the hover text formatted by Plotly from customdata arrays
+    Rows with the same hover lines share one trace and one hovertemplate, so no text is built per row
+    Large figures are drawn with WebGL
+    :param df: timeline DataFrame with the columns Date, Title, Color and Symbol
+    :return: plotly figure
+    """
+    fields = hover_fields(df)
+    present = np.zeros((len(df), len(fields)), dtype=bool)
+    for bit, (_, columns) in enumerate(fields):
+        present[:, bit] = np.logical_and.reduce([df[column].notna().to_numpy() & (df[column].to_numpy() != "") for column in columns])
+    pattern = present.astype(np.int64) @ (np.int64(1) << np.arange(len(fields), dtype=np.int64))
+    colors = {color: px.colors.qualitative.Plotly[i % len(px.colors.qualitative.Plotly)] for i, color in enumerate(df['Color'].unique())}
+
+    groups = pd.DataFrame({'Color': df['Color'].to_numpy(), 'Symbol': df['Symbol'].to_numpy(), 'Pattern': pattern})
+    trace_type = plot_utils.scatter_trace_type(len(df))
+    traces = []
+    for (color, symbol, key), positions in groups.groupby(['Color', 'Symbol', 'Pattern'], sort=False).indices.items():
+        lines, columns = [], []
+        for bit, (template, field_columns) in enumerate(fields):
+            if key >> bit & 1:
+                lines.append(template.format(*(f"%{{customdata[{len(columns) + i}]}}" for i in range(len(field_columns)))))
+                columns += field_columns
+        traces.append(trace_type(
+            x=df['Date'].to_numpy()[positions],
+            y=df['Title'].to_numpy()[positions],
+            mode="markers",
+            name=color,
+            marker=dict(size=12, opacity=0.7, color=colors[color], symbol=symbol),
+            customdata=df[columns].to_numpy()[positions] if columns else None,
+            hovertemplate="<br>".join(lines) + "<extra></extra>"
+        ))
+    fig = go.Figure(data=traces)
+    fig.update_layout(xaxis_title="Date", yaxis_title="Resource Type")
+    return fig
+
+def build_bucket_figure(buckets, resolution):
+    """
+    Plot day, week or month buckets of the timeline, the marker size grows with the number of events
+    :param buckets: DataFrame of TimelineAggregates.select
+    :param resolution: bucket size
+    :return: plotly figure
+    """
+    trace_type = plot_utils.scatter_trace_type(len(buckets))
+    traces = []
+    for (title, numeric), rows in buckets.groupby(['Title', buckets['Mean'].notna()], sort=False):
+        hover_lines = [f"{resolution.title()} of %{{x|%B %d, %Y}}", "Events: %{customdata[0]}"]
+        # buckets mixing analytes or units have no Mean and show the count only
+        if numeric:
+            hover_lines.append("Code: %{customdata[4]}")
+            hover_lines.append("Min / Mean / Max: %{customdata[1]:.1f} / %{customdata[2]:.1f} / %{customdata[3]:.1f} %{customdata[5]}")
+        traces.append(trace_type(
+            x=rows['Bucket'],
+            y=rows['Title'],
+            mode="markers",
+            name=title,
+            marker=dict(size=np.clip(6 + 3 * np.log2(rows['Count'].to_numpy(dtype=float)), 6, 24), opacity=0.7, color=px.colors.qualitative.Plotly[0]),
+            customdata=rows[['Count', 'Min', 'Mean', 'Max', 'Code', 'Unit']].to_numpy(),
+            hovertemplate="<br>".join(hover_lines) + "<extra></extra>"
+        ))
+    fig = go.Figure(data=traces)
+    fig.update_layout(xaxis_title="Date", yaxis_title="Resource Type")
+    return fig
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def aggregate_section(section_version, _section_data):
+    """Day/week/month aggregates of one IPS section, computed once per section content and shared read-only"""
+    return TimelineAggregates.from_timeline_data(_section_data)
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def prepare_timeline_aggregates(data_version, _sections):
+    """
+    Merge the aggregates of the sections, only sections with new content are aggregated again
+    The result is shared read-only like the frames; add() rebinds levels and never changes the cached section aggregates
+    :param data_version: content hash of the timeline data
+    :param _sections: list of (content hash, timeline data) per section
+    """
+    aggregates = TimelineAggregates()
+    for section_version, section_data in _sections:
+        aggregates.add(aggregate_section(section_version, section_data))
+    return aggregates
 
-    # Convert data into a DataFrame
-    df = pd.DataFrame(data)
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+@st.cache_resource(show_spinner=False, max_entries=8)
+def prepare_timeline_frames(data_version, _data):
+    """
+    Build the timeline DataFrames once per data version
+    The frames are shared by all sessions and reruns without a copy, callers must not mutate them
+    :param data_version: content hash of the timeline data
+    :param _data: timeline data (not hashed, identified by data_version)
+    :return: (date index of the rows with a valid date, rows without a valid date)
+    """
+    # Convert data into a DataFrame, dates with and without time or offset are all read as UTC
+    df = pd.DataFrame(_data)
+    df['Date'] = parse_dates(df['Date'])
 
     # Separate rows with invalid or missing dates
     no_date_df = df[df['Date'].isna()]
@@ -99,53 +193,128 @@ def print_timeline(data):
         #hemoglobin_df_timeline['Symbol'] = hemoglobin_df_timeline['Status'].map(lambda x: style_map[x]['symbol']).fillna('circle')
         #valid_date_df.loc[hemoglobin_df_timeline.index, ['Color', 'Symbol']] = hemoglobin_df_timeline[['Color', 'Symbol']]
 
-    # Sidebar filters
-    st.sidebar.header("Filter Options")
-    start_date = st.sidebar.date_input("Start Date", value=valid_date_df['Date'].min().date())
-    end_date = st.sidebar.date_input("End Date", value=valid_date_df['Date'].max().date())
-    if start_date > end_date:
-        st.sidebar.error("Start Date must be earlier than End Date.")
-        st.stop()
-    resource_types = valid_date_df['Title'].unique()
-    selected_resources = st.sidebar.multiselect(
-        "Filter by Resource Type", options=resource_types, default=resource_types
-    )
+    return TimelineIndex(valid_date_df), no_date_df
 
-    # Filter DataFrame
-    filtered_df = valid_date_df[
-        (valid_date_df['Date'] >= pd.Timestamp(start_date)) &
-        (valid_date_df['Date'] <= pd.Timestamp(end_date)) &
-        (valid_date_df['Title'].isin(selected_resources))
-    ]
-    filtered_df['hover_info'] = filtered_df.apply(generate_custom_data, axis=1)
+@st.cache_data(show_spinner=False, max_entries=32)
+def print_timeline_chart(data_version, start_date, end_date, selected_resources, _timeline_index, _aggregates):
+    """
+    Filter and plot the timeline, memoized on the data version and the filter values
+    The chart is replayed from the cache when only unrelated widgets change
+    Long ranges with many events are plotted as day, week or month buckets chosen by the date span
+    """
+    end_exclusive = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    # Filter DataFrame: binary search of the date window of every selected resource type
+    filtered_df = _timeline_index.select(start_date, end_exclusive, selected_resources)
 
     # Plot timeline
     if not filtered_df.empty:
-        fig = px.scatter(
-            filtered_df,
-            x="Date",
-            y="Title",
-            color="Color",
-            symbol="Symbol",
-            #color_discrete_map={val['color']: val['color'] for val in style_map.values()},
-            #symbol_map={val['symbol']: val['symbol'] for val in style_map.values()},
-            labels={"Date": "Date", "Title": "Resource Type", "Color": "Legend"},
-            custom_data=["hover_info"],
-            hover_data={"Symbol": False}
-        )
-        fig.update_traces(marker=dict(size=12, opacity=0.7), hovertemplate="%{customdata[0]}")
-        # Update legend with descriptions
-        #fig.for_each_trace(lambda t: t.update(name=color_symbol_map.get(f"{t.marker.color}, {t.marker.symbol}", t.name)))
+        if len(filtered_df) <= plot_utils.MAX_POINTS_PER_SERIES:
+            fig = build_timeline_figure(filtered_df)
+        else:
+            resolution = pick_resolution(start_date, end_date)
+            buckets = _aggregates.select(resolution, start_date, end_exclusive, selected_resources)
+            st.caption(f"{len(filtered_df)} events shown as {len(buckets)} {resolution} buckets. Narrow the date range to see single events.")
+            fig = build_bucket_figure(buckets, resolution)
         fig.update_layout(showlegend=False, clickmode="event+select", legend=dict(orientation="h", y=-0.2))
         st.plotly_chart(fig)
     else:
         st.warning("No data available for the selected filters.")
 
+def reset_filters(data_version, first_date, last_date, resource_types):
+    """The filters show the whole record again when the timeline data changes, e.g. for another patient"""
+    # the widget values are dropped from the session state while another page is shown
+    keys = ('timeline_start', 'timeline_end', 'timeline_resources')
+    if st.session_state.get('timeline_filters_version') != data_version or not all(key in st.session_state for key in keys):
+        st.session_state.timeline_filters_version = data_version
+        st.session_state.timeline_start = first_date
+        st.session_state.timeline_end = last_date
+        st.session_state.timeline_resources = list(resource_types)
+
+def jump_to_match(rows, first_date, last_date):
+    """
+    Narrow the sidebar filters to the search match chosen in the result list, called before the page reruns
+    :param rows: matching timeline rows
+    :param first_date: first date of the timeline
+    :param last_date: last date of the timeline
+    """
+    position = st.session_state.get('timeline_search_jump')
+    if position is None:
+        return
+    row = rows[position]
+    date = parse_dates(pd.Series([row.get('Date')])).iloc[0]
+    st.session_state.timeline_start = max(first_date, (date - pd.Timedelta(days=JUMP_DAYS)).date())
+    st.session_state.timeline_end = min(last_date, (date + pd.Timedelta(days=JUMP_DAYS)).date())
+    st.session_state.timeline_resources = [row['Title']]
+
+def search_record(first_date, last_date):
+    """
+    Search box over the loaded patient record, answered from the in-memory index of the section loader
+    A match can be chosen to narrow the timeline to its resource type and date
+    """
+    index = section_loader.get_search_index()
+    query = st.text_input("🔎 Search the record", key='timeline_search', placeholder="e.g. metformin, retinopathy, 4548-4")
+    if index is None or not query.strip():
+        return
+
+    start = time.perf_counter()
+    matches = index.search(query)
+    milliseconds = (time.perf_counter() - start) * 1000
+    st.caption(f"{len(matches)} matches in {len(index)} entries ({milliseconds:.2f} ms)")
+    if not len(matches):
+        return
+
+    rows = index.rows(matches)
+    results = pd.DataFrame(rows)
+    table_utils.paginated_table(results[[column for column in SEARCH_COLUMNS if column in results.columns]], key='timeline_search_results')
+
+    # only matches with a date can be shown on the timeline
+    dated = [position for position, date in enumerate(parse_dates(results['Date'])) if pd.notna(date)]
+    st.selectbox(
+        "Show on the timeline",
+        options=dated,
+        index=None,
+        format_func=lambda position: f"{rows[position]['Date'][:10]} · {rows[position]['Title']} · {rows[position].get('Name', '')}",
+        placeholder="Choose a match",
+        key='timeline_search_jump',
+        on_change=jump_to_match,
+        args=(rows, first_date, last_date)
+    )
+
+def print_timeline(data, data_version, sections):
+    # Verify the user's role
+    if not st.session_state.patient_id:
+        st.warning("No patient found.")
+        st.stop()
+
+    st.title("Clinical Timeline")
+
+    timeline_index, no_date_df = prepare_timeline_frames(data_version, data)
+    aggregates = prepare_timeline_aggregates(data_version, sections)
+
+    first_date, last_date = timeline_index.date_range()
+    resource_types = timeline_index.titles
+    reset_filters(data_version, first_date.date(), last_date.date(), resource_types)
+
+    search_record(first_date.date(), last_date.date())
+
+    # Sidebar filters, their values are kept in the session state so a search match can change them
+    st.sidebar.header("Filter Options")
+    start_date = st.sidebar.date_input("Start Date", key='timeline_start')
+    end_date = st.sidebar.date_input("End Date", key='timeline_end')
+    if start_date > end_date:
+        st.sidebar.error("Start Date must be earlier than End Date.")
+        st.stop()
+    selected_resources = st.sidebar.multiselect(
+        "Filter by Resource Type", options=resource_types, key='timeline_resources'
+    )
+
+    print_timeline_chart(data_version, start_date, end_date, tuple(selected_resources), timeline_index, aggregates)
+
     # Display table for entries without a valid date
     if not no_date_df.empty:
         st.subheader("Entries Without a Valid Date")
         # Remove columns where all values are NaN or empty
-        no_date_df_cleaned = no_date_df.dropna(axis=1, how='all')
+        no_date_df_cleaned = no_date_df.drop(columns=NO_DATE_HIDDEN_COLUMNS, errors='ignore').dropna(axis=1, how='all')
         st.table(no_date_df_cleaned)
 
-print_timeline(timeline_data)
\ No newline at end of file
+print_timeline(timeline_data, section_loader.get_data_version(SECTIONS), section_loader.get_section_data(SECTIONS))
\ No newline at end of file